@@ -5,9 +5,15 @@ import string
 import socket
 import os
 import time
+import atexit
+import json
+import queue
+import threading
+from datetime import datetime, timezone
 from requests.auth import HTTPBasicAuth
 from ldap3 import Server, Connection, ALL, SUBTREE
 import logging
+import logging.handlers
 
 # CONFIGURATION
 AD_DOMAIN = os.getenv("AD_DOMAIN", "my-ad-domain")
@@ -62,34 +68,112 @@ class ColorCodes:
     CRITICAL = "\033[31;1m"  # Bold Red
 
 
+LOG_FORMAT = os.getenv("LOG_FORMAT", "color")  # color|json, json writes one object per line for log shipping
+LOG_REPEAT_LIMIT = int(os.getenv("LOG_REPEAT_LIMIT", "0"))  # identical messages logged per LOG_REPEAT_WINDOW, 0 (default) logs all
+LOG_REPEAT_WINDOW = float(os.getenv("LOG_REPEAT_WINDOW", "60"))
+
+
 class ColoredFormatter(logging.Formatter):
-    FORMATS = {
-        logging.DEBUG: ColorCodes.DEBUG + "%(levelname)s: %(message)s" + ColorCodes.RESET,
-        logging.INFO: ColorCodes.INFO + "%(levelname)s: %(message)s" + ColorCodes.RESET,
-        logging.WARNING: ColorCodes.WARNING + "%(levelname)s: %(message)s" + ColorCodes.RESET,
-        logging.ERROR: ColorCodes.ERROR + "%(levelname)s: %(message)s" + ColorCodes.RESET,
-        logging.CRITICAL: ColorCodes.CRITICAL + "%(levelname)s: %(message)s" + ColorCodes.RESET,
+    LOG_FORMAT = "%(levelname)s: %(message)s"
+    COLORS = {
+        logging.DEBUG: ColorCodes.DEBUG,
+        logging.INFO: ColorCodes.INFO,
+        logging.WARNING: ColorCodes.WARNING,
+        logging.ERROR: ColorCodes.ERROR,
+        logging.CRITICAL: ColorCodes.CRITICAL,
     }
 
+    def __init__(self):
+        super().__init__()
+        # built once, not per record
+        self.formatters = {level: logging.Formatter(color + self.LOG_FORMAT + ColorCodes.RESET) for level, color in self.COLORS.items()}
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
-        return formatter.format(record)
+        return self.formatters.get(record.levelno, self.formatters[logging.INFO]).format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RepeatFilter(logging.Filter):
+    # lets an identical message through LOG_REPEAT_LIMIT times per LOG_REPEAT_WINDOW, how many were dropped is logged when the window ends
+    def __init__(self, limit=LOG_REPEAT_LIMIT, window=LOG_REPEAT_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.seen = {}  # (level, message) -> [window start, count]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.limit <= 0:
+            return True
+        key = (record.levelno, record.getMessage())
+        now = time.time()
+        with self.lock:
+            if len(self.seen) > 1000:
+                self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.window}
+            entry = self.seen.setdefault(key, [now, 0])
+            if now - entry[0] >= self.window:
+                suppressed = entry[1] - self.limit
+                entry[:] = [now, 0]
+                if suppressed > 0:
+                    record.msg, record.args = f"{record.getMessage()} (repeated {suppressed} more times)", None
+            entry[1] += 1
+            if entry[1] == self.limit + 1:
+                # the first drop of this window, report the count once the window is over even if the message never comes back
+                timer = threading.Timer(entry[0] + self.window - now, self.report, args=(key, entry[0], record))
+                timer.daemon = True
+                timer.start()
+            return entry[1] <= self.limit
+
+    def report(self, key, started, record):
+        with self.lock:
+            entry = self.seen.get(key)
+            # a matching record after the window may have reported (and restarted) it already
+            if entry is None or entry[0] != started:
+                return
+            suppressed = entry[1] - self.limit
+            del self.seen[key]
+        summary = logging.makeLogRecord(dict(record.__dict__, msg=f"{record.getMessage()} (repeated {suppressed} more times)", args=None))
+        summary.created = time.time()
+        logging.getLogger(record.name).handle(summary)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # same process, the record goes to the listener as is, formatting happens over there
+        return record
 
 
 # Get a logger instance
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)  # Set the desired logging level
 
-# Create a stream handler to output to the console
+# Create a stream handler to output to the console, written by a listener thread so syncing never waits on stderr
 ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
 
 # Set the custom formatter for the handler
-ch.setFormatter(ColoredFormatter())
+ch.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else ColoredFormatter())
+
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, ch)
+log_listener.start()
+atexit.register(log_listener.stop)  # flushes what is still queued
 
 # Add the handler to the logger
-logger.addHandler(ch)
+log_handler = LogQueueHandler(log_queue)
+log_handler.addFilter(RepeatFilter())
+logger.addHandler(log_handler)
 
 
 def is_enabled(uac_attr):
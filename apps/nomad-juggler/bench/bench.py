@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+"""nomad-juggler benchmark against an in-process fake Nomad API, no cluster needed.
+
+    python bench/bench.py                                  # every scenario with the defaults
+    python bench/bench.py restart --allocs 500 --latency restart=0.05
+    python bench/bench.py tails --tails 1000 --server gevent
+    python bench/bench.py --json > baseline.json           # keep a baseline ...
+    python bench/bench.py --compare baseline.json          # ... and exit 1 once p99/upstream calls/RSS regress
+
+Each scenario gets a fresh fake Nomad and a fresh juggler process, so upstream call counts and peak RSS
+(VmHWM of juggler and its workers, Linux only) belong to that scenario alone.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_JOB = "bench-service"
+BATCH_JOB = "bench-batch"
+TOKEN = "00000000-0000-0000-0000-000000000000"
+LOG_LINE = b"bench log line, nothing to see here\n"
+
+
+def iso_time(ts):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts)) + ".%09dZ" % int((ts % 1) * 1e9)
+
+
+class FakeNomadServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that takes the bench's concurrency (the default listen backlog of 5 resets connections)
+    and counts requests it failed to serve, those are the fake's errors and not juggler's."""
+
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def __init__(self, address, handler):
+        super().__init__(address, handler)
+        self.errors = 0
+        self.errors_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        with self.errors_lock:
+            self.errors += 1
+
+
+class FakeNomad:
+    """Just enough of the Nomad HTTP API for juggler: allocation lists (blocking queries), alloc restarts,
+    dispatches, log tails/follows and the event stream.
+
+    latency maps an op (allocations, restart, dispatch, logs, event_stream) to the seconds every call of it
+    takes, "default" applies to all others. Calls are counted per op.
+    """
+
+    def __init__(self, allocs=500, nodes=20, job_duration=2.0, restart_delay=0.5, latency=None):
+        self.job_duration = job_duration
+        self.restart_delay = restart_delay
+        self.latency = latency or {}
+        self.calls = Counter()
+        self.calls_lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.index = 1
+        self.allocs = {}
+        self.subscribers = []
+        self.dispatch_ids = itertools.count()
+        self.stopping = threading.Event()
+        now = time.time()
+        for i in range(allocs):
+            alloc_id = f"{i:08x}-0000-0000-0000-000000000000"
+            self.allocs[alloc_id] = {
+                "ID": alloc_id,
+                "JobID": SERVICE_JOB,
+                "Namespace": "default",
+                "NodeID": f"node-{i % nodes}",
+                "NodeName": f"client-{i % nodes}",
+                "ClientStatus": "running",
+                "CreateTime": int(now * 1e9),
+                "ModifyIndex": 1,
+                "TaskStates": {"app": {"State": "running", "Restarts": 0, "LastRestart": None, "StartedAt": iso_time(now)}},
+            }
+
+    def start(self):
+        handler = type("Handler", (FakeNomadHandler,), {"nomad": self})
+        self.server = FakeNomadServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, name="fake-nomad", daemon=True).start()
+        self.address = f"http://127.0.0.1:{self.server.server_address[1]}"
+        return self.address
+
+    def stop(self):
+        self.stopping.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def call(self, op):
+        with self.calls_lock:
+            self.calls[op] += 1
+        time.sleep(self.latency.get(op, self.latency.get("default", 0.0)))
+
+    def update(self, alloc_id, **changes):
+        with self.cond:
+            alloc = self.allocs[alloc_id]
+            alloc.update(changes)
+            self.index += 1
+            alloc["ModifyIndex"] = self.index
+            self.cond.notify_all()
+            frame = {
+                "Index": self.index,
+                "Events": [{"Topic": "Allocation", "Type": "AllocationUpdated", "Payload": {"Allocation": dict(alloc)}}],
+            }
+            for subscriber in list(self.subscribers):
+                subscriber.put(frame)
+
+    def restart(self, alloc_id):
+        time.sleep(self.restart_delay)
+        task_states = {}
+        for task, state in self.allocs[alloc_id]["TaskStates"].items():
+            task_states[task] = dict(state, Restarts=state["Restarts"] + 1, LastRestart=iso_time(time.time()))
+        self.update(alloc_id, TaskStates=task_states)
+
+    def run_dispatch(self, job_id, alloc_id):
+        time.sleep(0.2)
+        with self.cond:
+            self.allocs[alloc_id] = {"ID": alloc_id, "JobID": job_id, "Namespace": "default", "NodeID": "node-0", "ModifyIndex": 0}
+        self.update(alloc_id, ClientStatus="pending", CreateTime=int(time.time() * 1e9), TaskStates={"main": {"State": "pending"}})
+        time.sleep(0.1)
+        self.update(alloc_id, ClientStatus="running", TaskStates={"main": {"State": "running", "StartedAt": iso_time(time.time())}})
+        time.sleep(self.job_duration)
+        self.update(
+            alloc_id, ClientStatus="complete", TaskStates={"main": {"State": "dead", "Failed": False, "FinishedAt": iso_time(time.time())}}
+        )
+
+
+class FakeNomadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    nomad = None
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, code=200):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Nomad-Index", str(self.nomad.index))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def start_chunked(self):
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def parse(self):
+        url = urllib.parse.urlparse(self.path)
+        return urllib.parse.unquote(url.path), {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+
+    def do_GET(self):
+        nomad = self.nomad
+        path, params = self.parse()
+        match = re.fullmatch(r"/v1/job/(.+)/allocations", path)
+        if match:
+            nomad.call("allocations")
+            index = int(params.get("index", 0))
+            if index:
+                wait = float(params.get("wait", "300s").rstrip("s"))
+                with nomad.cond:
+                    nomad.cond.wait_for(lambda: nomad.index > index or nomad.stopping.is_set(), timeout=wait)
+            with nomad.cond:
+                allocs = [dict(alloc) for alloc in nomad.allocs.values() if alloc["JobID"] == match.group(1)]
+            return self.reply(allocs)
+
+        if path == "/v1/allocations":
+            # only what juggler filters on: JobID == "..." and ClientStatus == "running"
+            nomad.call("allocations_filtered")
+            job = re.search(r'JobID == "([^"]*)"', params.get("filter", ""))
+            with nomad.cond:
+                allocs = [
+                    dict(alloc)
+                    for alloc in nomad.allocs.values()
+                    if (not job or alloc["JobID"] == job.group(1)) and alloc["ClientStatus"] == "running"
+                ]
+            return self.reply(allocs)
+
+        match = re.fullmatch(r"/v1/allocation/([^/]+)", path)
+        if match:
+            nomad.call("allocation")
+            alloc = nomad.allocs.get(match.group(1))
+            return self.reply(alloc) if alloc else self.reply(b"alloc not found", 404)
+
+        match = re.fullmatch(r"/v1/client/fs/logs/([^/]+)", path)
+        if match:
+            nomad.call("logs")
+            if params.get("follow") != "true":
+                return self.reply((LOG_LINE * 1000)[-int(params.get("offset", 10000)) :])
+            self.start_chunked()
+            try:
+                while nomad.allocs.get(match.group(1), {}).get("ClientStatus") in ("pending", "running") and not nomad.stopping.is_set():
+                    self.chunk(LOG_LINE)
+                    time.sleep(0.5)
+                self.chunk(b"")
+            except OSError:
+                pass
+            return
+
+        if path == "/v1/event/stream":
+            nomad.call("event_stream")
+            subscriber = queue.Queue()
+            nomad.subscribers.append(subscriber)
+            self.start_chunked()
+            try:
+                while not nomad.stopping.is_set():
+                    try:
+                        frame = subscriber.get(timeout=5)
+                    except queue.Empty:
+                        frame = {}  # heartbeat
+                    self.chunk((json.dumps(frame) + "\n").encode())
+            except OSError:
+                pass
+            finally:
+                nomad.subscribers.remove(subscriber)
+            self.close_connection = True
+            return
+
+        nomad.call("other")
+        self.reply(b"not found", 404)
+
+    def do_POST(self):
+        nomad = self.nomad
+        path, _ = self.parse()
+        self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+
+        match = re.fullmatch(r"/v1/client/allocation/([^/]+)/restart", path)
+        if match:
+            nomad.call("restart")
+            if match.group(1) not in nomad.allocs:
+                return self.reply(b"alloc not found", 404)
+            threading.Thread(target=nomad.restart, args=(match.group(1),), daemon=True).start()
+            return self.reply({})
+
+        match = re.fullmatch(r"/v1/job/(.+)/dispatch", path)
+        if match:
+            nomad.call("dispatch")
+            number = next(nomad.dispatch_ids)
+            job_id = f"{match.group(1)}/dispatch-{int(time.time())}-{number:08x}"
+            alloc_id = f"{number:08x}-1111-0000-0000-000000000000"
+            threading.Thread(target=nomad.run_dispatch, args=(job_id, alloc_id), daemon=True).start()
+            return self.reply({"DispatchedJobID": job_id, "EvalID": "", "Index": nomad.index})
+
+        nomad.call("other")
+        self.reply(b"not found", 404)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(pid):
+    pids = [pid]
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            for child in f.read().split():
+                pids.extend(process_tree(int(child)))
+    return pids
+
+
+def peak_rss_mb(pid):
+    # VmHWM (peak resident set) of juggler plus its workers, None where /proc is not available
+    try:
+        total = 0
+        for member in process_tree(pid):
+            with open(f"/proc/{member}/status") as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+        return round(total / 1024, 1)
+    except (OSError, StopIteration):
+        return None
+
+
+class Juggler:
+    """nomad-juggler.py in a subprocess, served the way --server says (flask, gevent or gunicorn)."""
+
+    def __init__(self, nomad_addr, server="flask", env=None):
+        self.port = free_port()
+        self.address = f"http://127.0.0.1:{self.port}"
+        self.registry = tempfile.NamedTemporaryFile(prefix="juggler-bench-", suffix=".sqlite", delete=False).name
+        environment = dict(
+            os.environ,
+            NOMAD_ADDR=nomad_addr,
+            NOMAD_PORT_juggler=str(self.port),
+            FAVICON_URL=f"{nomad_addr}/favicon.ico",
+            JOB_REGISTRY_PATH=self.registry,
+            JUGGLER_SERVER="gevent" if server == "gevent" else "flask",
+            **(env or {}),
+        )
+        if server == "gunicorn":
+            command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{self.port}", "nomad-juggler:app"]
+        else:
+            command = [sys.executable, "nomad-juggler.py"]
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, cwd=APP_DIR, env=environment, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + 30
+        while True:
+            try:
+                if requests.get(f"{self.address}/health", timeout=1).status_code == 200:
+                    return
+            except requests.exceptions.RequestException:
+                pass
+            if self.process.poll() is not None or time.time() > deadline:
+                self.log.seek(0)
+                raise RuntimeError(f"juggler did not come up:\n{self.log.read().decode(errors='replace')[-2000:]}")
+            time.sleep(0.2)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.unlink(self.registry + suffix)
+            except OSError:
+                pass
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))], 4)
+
+
+def drive(urls, concurrency, expected=(200,), timeout=1800):
+    # GET every url with at most concurrency in flight, returns (latencies, errors, wall seconds)
+    def fetch(url):
+        started = time.time()
+        try:
+            resp = requests.get(url, timeout=timeout)
+            ok = resp.status_code in expected
+        except requests.exceptions.RequestException:
+            ok = False
+        return time.time() - started, ok
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(urls)))) as pool:
+        results = list(pool.map(fetch, urls))
+    return [latency for latency, _ in results], sum(1 for _, ok in results if not ok), time.time() - started
+
+
+def scenario_restart(args, juggler):
+    # restart every alloc of a big service job and wait for all of them to come back, --rounds times in a row
+    query = f"wait=true&max_parallel={args.max_parallel}&per_node_parallel={args.per_node_parallel}"
+    url = f"{juggler.address}/api/{TOKEN}/default/restart/{SERVICE_JOB}?{query}"
+    return drive([url] * args.rounds, 1)
+
+
+def scenario_tails(args, juggler):
+    # many concurrent dispatch+tail requests, each held open until its job finished
+    urls = [f"{juggler.address}/api/{TOKEN}/default/dispatch/{BATCH_JOB}?tail=true&N={i}" for i in range(args.tails)]
+    return drive(urls, args.tails)
+
+
+def scenario_burst(args, juggler):
+    # a burst of plain dispatches (no tail), --concurrency at a time
+    urls = [f"{juggler.address}/api/{TOKEN}/default/dispatch/{BATCH_JOB}?N={i}" for i in range(args.burst)]
+    return drive(urls, args.concurrency)
+
+
+SCENARIOS = {"restart": scenario_restart, "tails": scenario_tails, "burst": scenario_burst}
+
+
+def run_scenario(name, args):
+    nomad = FakeNomad(args.allocs, args.nodes, args.job_duration, args.restart_delay, args.latency)
+    juggler = Juggler(nomad.start(), args.server)
+    try:
+        # juggler's own startup calls are not part of the scenario
+        with nomad.calls_lock:
+            nomad.calls.clear()
+        with nomad.server.errors_lock:
+            nomad.server.errors = 0
+        latencies, errors, wall = SCENARIOS[name](args, juggler)
+        rss = peak_rss_mb(juggler.process.pid)
+    finally:
+        juggler.stop()
+        nomad.stop()
+    calls = dict(sorted(nomad.calls.items()))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "fake_errors": nomad.server.errors,
+        "seconds": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall else None,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+        "max": round(max(latencies), 4) if latencies else None,
+        "upstream_calls": calls,
+        "upstream_total": sum(calls.values()),
+        "peak_rss_mb": rss,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # regressions beyond tolerance (fraction) against a previous --json run
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for metric in ("p99", "upstream_total", "peak_rss_mb"):
+            if result.get(metric) is None or not before.get(metric):
+                continue
+            if result[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {before[metric]} -> {result[metric]}")
+        # a run where the fake itself failed says nothing about juggler's errors
+        if result.get("fake_errors"):
+            print(f"{name}: fake Nomad failed {result['fake_errors']} requests, errors not compared", file=sys.stderr)
+        elif result["errors"] > before.get("errors", 0):
+            regressions.append(f"{name}.errors: {before.get('errors', 0)} -> {result['errors']}")
+    return regressions
+
+
+def parse_latency(values):
+    # ["0.01", "restart=0.2"] -> {"default": 0.01, "restart": 0.2}
+    latency = {}
+    for value in values:
+        op, _, seconds = value.rpartition("=")
+        latency[op or "default"] = float(seconds)
+    return latency
+
+
+def print_table(results):
+    columns = ["requests", "errors", "fake_errors", "seconds", "rps", "p50", "p90", "p99", "max", "upstream_total", "peak_rss_mb"]
+    print(f"{'scenario':<10}" + "".join(f"{column:>15}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<10}" + "".join(f"{str(result[column]):>15}" for column in columns))
+    for name, result in results.items():
+        print(f"{name} upstream calls: {result['upstream_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nomad-juggler against a fake Nomad API")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"{'|'.join(SCENARIOS)} (default: all)")
+    parser.add_argument("--server", choices=["flask", "gevent", "gunicorn"], default="flask", help="how juggler is served")
+    parser.add_argument("--allocs", type=int, default=500, help="allocations of the service job (restart)")
+    parser.add_argument("--nodes", type=int, default=20, help="client nodes the allocations are spread over")
+    parser.add_argument("--rounds", type=int, default=3, help="restart requests, one after the other")
+    parser.add_argument("--max-parallel", type=int, default=10, help="restart max_parallel")
+    parser.add_argument("--per-node-parallel", type=int, default=1, help="restart per_node_parallel")
+    parser.add_argument("--tails", type=int, default=1000, help="concurrent dispatch+tail requests")
+    parser.add_argument("--burst", type=int, default=500, help="plain dispatches in the burst")
+    parser.add_argument("--concurrency", type=int, default=50, help="burst requests in flight")
+    parser.add_argument("--job-duration", type=float, default=2.0, help="seconds a dispatched job runs")
+    parser.add_argument("--restart-delay", type=float, default=0.5, help="seconds until a restarted alloc reports its restart")
+    parser.add_argument(
+        "--latency", action="append", default=[], help="upstream latency in seconds, for all ops or per op (op=seconds), repeatable"
+    )
+    parser.add_argument("--json", action="store_true", help="print the results as JSON (usable as --compare baseline)")
+    parser.add_argument("--compare", help="baseline JSON, exit 1 when p99, upstream calls or peak RSS regressed")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression against the baseline (fraction)")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}, choose from {', '.join(SCENARIOS)}")
+    args.latency = {"default": 0.005, **parse_latency(args.latency)}
+
+    results = {}
+    for name in args.scenarios or list(SCENARIOS):
+        print(f"running {name} ...", file=sys.stderr)
+        results[name] = run_scenario(name, args)
+
+    if args.json:
+        print(json.dumps({"server": args.server, "latency": args.latency, "scenarios": results}, indent=2))
+    else:
+        print_table(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+# gunicorn -c gunicorn.conf.py nomad-juggler:app
+#
+# gevent workers run every request as a greenlet, so long held tails/waits (up to timeout=1200s)
+# no longer pin a worker each; one worker can hold thousands of them.
+import os
+
+bind = f"0.0.0.0:{os.getenv('NOMAD_PORT_juggler', '5000')}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "2000"))
+# tails are long lived by design, the sync worker default of 30s would kill them
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "1300"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
@@ -1,12 +1,45 @@
-from flask import Flask, Response, request, jsonify, send_file, url_for
 import os
+
+# JUGGLER_SERVER=gevent serves from a single process where every request (and every tail/wait) is a greenlet,
+# the blocking calls below (sockets, sleeps, locks, threads) are made cooperative before anything imports them.
+JUGGLER_SERVER = os.getenv("JUGGLER_SERVER", "flask")
+if JUGGLER_SERVER == "gevent" and __name__ == "__main__":
+    from gevent import monkey
+
+    monkey.patch_all()
+
+from flask import Flask, Response, g, request, jsonify, url_for
+import atexit
 import logging
+import logging.handlers
 import urllib.parse
 import requests
+import socket
+import sqlite3
+import tempfile
 import time
-import base64
-from datetime import datetime
+import uuid
+import contextvars
+import fnmatch
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import random
+import re
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures, FIRST_COMPLETED
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
 
 app = Flask(__name__)
 metrics = PrometheusMetrics(app, group_by="endpoint")
@@ -30,56 +63,1339 @@ class ColorCodes:
     CRITICAL = "\033[31;1m"  # Bold Red
 
 
+LOG_FORMAT = os.getenv("LOG_FORMAT", "color")  # color|json, json writes one object per line for log shipping
+LOG_REPEAT_LIMIT = int(os.getenv("LOG_REPEAT_LIMIT", "0"))  # identical messages logged per LOG_REPEAT_WINDOW, 0 (default) logs all
+LOG_REPEAT_WINDOW = float(os.getenv("LOG_REPEAT_WINDOW", "60"))
+
+
 class ColoredFormatter(logging.Formatter):
-    FORMATS = {
-        logging.DEBUG: ColorCodes.DEBUG + "%(asctime)s [%(levelname)s] %(name)s.%(funcName)s:%(lineno)d: %(message)s" + ColorCodes.RESET,
-        logging.INFO: ColorCodes.INFO + "%(asctime)s [%(levelname)s] %(name)s.%(funcName)s:%(lineno)d: %(message)s" + ColorCodes.RESET,
-        logging.WARNING: ColorCodes.WARNING
-        + "%(asctime)s [%(levelname)s] %(name)s.%(funcName)s:%(lineno)d: %(message)s"
-        + ColorCodes.RESET,
-        logging.ERROR: ColorCodes.ERROR + "%(asctime)s [%(levelname)s] %(name)s.%(funcName)s:%(lineno)d: %(message)s" + ColorCodes.RESET,
-        logging.CRITICAL: ColorCodes.CRITICAL
-        + "%(asctime)s [%(levelname)s] %(name)s.%(funcName)s:%(lineno)d: %(message)s"
-        + ColorCodes.RESET,
+    LOG_FORMAT = "%(asctime)s [%(levelname)s] %(name)s.%(funcName)s:%(lineno)d: %(message)s"
+    COLORS = {
+        logging.DEBUG: ColorCodes.DEBUG,
+        logging.INFO: ColorCodes.INFO,
+        logging.WARNING: ColorCodes.WARNING,
+        logging.ERROR: ColorCodes.ERROR,
+        logging.CRITICAL: ColorCodes.CRITICAL,
     }
 
+    def __init__(self):
+        super().__init__()
+        # built once, not per record
+        self.formatters = {
+            level: logging.Formatter(color + self.LOG_FORMAT + ColorCodes.RESET, datefmt="%Y-%m-%d %H:%M:%S %z")
+            for level, color in self.COLORS.items()
+        }
+
+    def format(self, record):
+        return self.formatters.get(record.levelno, self.formatters[logging.INFO]).format(record)
+
+
+class JsonFormatter(logging.Formatter):
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt, datefmt="%Y-%m-%d %H:%M:%S %z")
-        return formatter.format(record)
+        # dict messages (eg. request summaries) stay structured
+        message = record.msg if isinstance(record.msg, dict) and not record.args else record.getMessage()
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "line": record.lineno,
+            "message": message,
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RepeatFilter(logging.Filter):
+    """Lets an identical message through LOG_REPEAT_LIMIT times per LOG_REPEAT_WINDOW, how many were dropped is logged when the window ends."""
+
+    def __init__(self, limit=LOG_REPEAT_LIMIT, window=LOG_REPEAT_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.seen = {}  # (level, message) -> [window start, count]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.limit <= 0:
+            return True
+        key = (record.levelno, record.getMessage())
+        now = time.time()
+        with self.lock:
+            if len(self.seen) > 1000:
+                self.seen = {k: v for k, v in self.seen.items() if now - v[0] < self.window}
+            entry = self.seen.setdefault(key, [now, 0])
+            if now - entry[0] >= self.window:
+                suppressed = entry[1] - self.limit
+                entry[:] = [now, 0]
+                if suppressed > 0:
+                    record.msg, record.args = f"{record.getMessage()} (repeated {suppressed} more times)", None
+            entry[1] += 1
+            if entry[1] == self.limit + 1:
+                # the first drop of this window, report the count once the window is over even if the message never comes back
+                timer = threading.Timer(entry[0] + self.window - now, self.report, args=(key, entry[0], record))
+                timer.daemon = True
+                timer.start()
+            return entry[1] <= self.limit
+
+    def report(self, key, started, record):
+        with self.lock:
+            entry = self.seen.get(key)
+            # a matching record after the window may have reported (and restarted) it already
+            if entry is None or entry[0] != started:
+                return
+            suppressed = entry[1] - self.limit
+            del self.seen[key]
+        summary = logging.makeLogRecord(dict(record.__dict__, msg=f"{record.getMessage()} (repeated {suppressed} more times)", args=None))
+        summary.created = time.time()
+        logging.getLogger(record.name).handle(summary)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # same process, the record goes to the listener as is, formatting happens over there
+        return record
+
+
+class LogPipeline:
+    """Request threads only put records on a queue, a listener thread formats and writes them to stderr."""
+
+    def __init__(self, formatter):
+        self.queue = queue.SimpleQueue()
+        output = logging.StreamHandler()
+        output.setLevel(logging.DEBUG)
+        output.setFormatter(formatter)
+        self.output = output
+        self.listener = None
+        self.handler = LogQueueHandler(self.queue)
+        self.handler.addFilter(RepeatFilter())
+
+    def start(self):
+        # also the after fork hook: the parent's listener thread does not exist in a child, a new listener takes over
+        self.listener = logging.handlers.QueueListener(self.queue, self.output)
+        self.listener.start()
+
+    def stop(self):
+        # flushes what is still queued
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
 
 
 if not logger.handlers:
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
-    ch.setFormatter(ColoredFormatter())
-    logger.addHandler(ch)
+    log_pipeline = LogPipeline(JsonFormatter() if LOG_FORMAT == "json" else ColoredFormatter())
+    log_pipeline.start()
+    os.register_at_fork(after_in_child=log_pipeline.start)
+    atexit.register(log_pipeline.stop)
+    logger.addHandler(log_pipeline.handler)
 
 NOMAD_ADDR = os.getenv("NOMAD_ADDR", "http://localhost:4646")
 TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", "3"))
-POLL_INTERVAL = int(os.getenv("REQUEST_TIMEOUT", "5"))
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "5"))
+POLL_MAX_INTERVAL = int(os.getenv("POLL_MAX_INTERVAL", "30"))  # fallback polls back off up to this while nothing changes
+
+# process wide budget per Nomad address (token bucket), interactive calls go before background polls
+NOMAD_RATE_LIMIT = float(os.getenv("NOMAD_RATE_LIMIT", "50"))  # calls per second, 0 disables
+NOMAD_RATE_BURST = int(os.getenv("NOMAD_RATE_BURST", "100"))
+NOMAD_RETRIES = int(os.getenv("NOMAD_RETRIES", "2"))  # GETs repeated after a 429/5xx
+NOMAD_BACKOFF_MAX = float(os.getenv("NOMAD_BACKOFF_MAX", "30"))  # longest pause of a Nomad address after 429/503/Retry-After
+
+# circuit breaker per Nomad address: open after consecutive failures (connection errors, timeouts, 502/503/504) or slow calls,
+# fail fast with 503 while open
+BREAKER_FAILURE_CODES = (502, 503, 504)  # other status codes (eg. a 500 for one bad dispatch) say nothing about the address
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "2"))  # calls on the default timeout slower than this count as slow
+BREAKER_SLOW_CALLS = int(os.getenv("BREAKER_SLOW_CALLS", "10"))  # consecutive slow calls, 0 disables the latency trigger
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # before a trial call is let through
+# background probe of NOMAD_ADDR (/v1/status/leader) reported by /health?deep=1, 0 disables
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "10"))
+
+# shared keep-alive connection pools towards Nomad
+NOMAD_POOL_SIZE = int(os.getenv("NOMAD_POOL_SIZE", "20"))  # connections kept per host
+NOMAD_POOL_HOSTS = int(os.getenv("NOMAD_POOL_HOSTS", "10"))  # hosts (servers/clients) with a pool
+NOMAD_KEEPALIVE = os.getenv("NOMAD_KEEPALIVE", "true").lower() == "true"
+NOMAD_KEEPALIVE_IDLE = int(os.getenv("NOMAD_KEEPALIVE_IDLE", "30"))  # seconds before TCP keepalive probes start
+
+# send allocation restarts and log reads straight to the allocation's client node (its HTTPAddr from /v1/node/<id>)
+# instead of through NOMAD_ADDR, falling back to NOMAD_ADDR when the node cannot be looked up or reached
+CLIENT_DIRECT = os.getenv("CLIENT_DIRECT", "false").lower() == "true"
+CLIENT_ADDR_TTL = float(os.getenv("CLIENT_ADDR_TTL", "300"))  # seconds a node address (or its failed lookup) is kept
+
+# short lived cache of job allocation lists, identical concurrent fetches are coalesced into one
+ALLOC_CACHE_TTL = float(os.getenv("ALLOC_CACHE_TTL", "2"))  # seconds, 0 disables caching (coalescing stays)
+ALLOC_CACHE_MAX_BYTES = int(os.getenv("ALLOC_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ALLOC_CACHE_MAX_ENTRIES = int(os.getenv("ALLOC_CACHE_MAX_ENTRIES", "1000"))
+# restarts list only the running allocations (/v1/allocations?filter=, Nomad 1.2+) instead of the job's whole allocation history
+ALLOC_LIST_FILTER = os.getenv("ALLOC_LIST_FILTER", "true").lower() == "true"
+
+# capabilities of a token (/v1/acl/token/self + its policies), checked before touching a job
+ACL_PRECHECK = os.getenv("ACL_PRECHECK", "true").lower() == "true"
+ACL_CACHE_TTL = float(os.getenv("ACL_CACHE_TTL", "60"))  # seconds
+ACL_CACHE_MAX_ENTRIES = int(os.getenv("ACL_CACHE_MAX_ENTRIES", "1000"))
+
+# restart fan-out defaults, overridable per request with max_parallel / per_node_parallel / batch_size / batch_pause
+RESTART_MAX_PARALLEL = int(os.getenv("RESTART_MAX_PARALLEL", "10"))
+RESTART_PER_NODE_PARALLEL = int(os.getenv("RESTART_PER_NODE_PARALLEL", "1"))
+RESTART_BATCH_SIZE = int(os.getenv("RESTART_BATCH_SIZE", "0"))  # 0 = all allocations in one batch
+RESTART_BATCH_PAUSE = os.getenv("RESTART_BATCH_PAUSE", "0s")
+# longest single Nomad blocking query (seconds), Nomad itself caps "wait" at 10m
+BLOCKING_QUERY_WAIT = int(os.getenv("BLOCKING_QUERY_WAIT", "300"))
+
+# tails follow /v1/event/stream instead of polling, one subscription per namespace shared by all open tails
+EVENT_STREAM_ENABLED = os.getenv("EVENT_STREAM_ENABLED", "true").lower() == "true"
+EVENT_STREAM_TOKEN = os.getenv("EVENT_STREAM_TOKEN")  # optional dedicated token, otherwise the caller's token is used
+EVENT_STREAM_RESYNC = int(os.getenv("EVENT_STREAM_RESYNC", "60"))  # seconds between safety re-reads while subscribed
+EVENT_STREAM_LINGER = int(os.getenv("EVENT_STREAM_LINGER", "30"))  # seconds an idle subscription stays connected
+
+# live log streaming (stream=text|sse)
+LOG_STREAM_QUEUE = int(os.getenv("LOG_STREAM_QUEUE", "256"))  # lines buffered between Nomad and a slow client
+LOG_STREAM_MAX_LINE = int(os.getenv("LOG_STREAM_MAX_LINE", "65536"))  # bytes, longer lines are split
+LOG_STREAM_DRAIN = int(os.getenv("LOG_STREAM_DRAIN", "5"))  # seconds to keep reading logs after the task finished
+
+# longest long-poll on the status endpoint (?wait=), seconds
+STATUS_MAX_WAIT = int(os.getenv("STATUS_MAX_WAIT", "300"))
+
+# bytes of stdout/stderr returned for failed dispatches, overridable per request with log_bytes
+LOG_TAIL_BYTES = int(os.getenv("LOG_TAIL_BYTES", "10000"))
+MAX_LOG_BYTES = int(os.getenv("MAX_LOG_BYTES", "1048576"))  # upper bound of log_bytes
+
+# upper bound of the per request timeout (seconds) of restart/dispatch/dispatch-batch waits
+MAX_WAIT_TIMEOUT = int(os.getenv("MAX_WAIT_TIMEOUT", "86400"))
+
+# query parameters consumed by juggler itself, never passed on as dispatch meta
+JUGGLER_PARAMS = ["tail", "dry_run", "verbose", "stream", "log_bytes", "region", "regions", "idempotency_key", "dedupe"]
+
+# identical dispatches (token, region, namespace, job, meta, idempotency_key) within this many seconds return the first
+# DispatchedJobID without calling Nomad, with a caller supplied idempotency_key the key also goes to Nomad as IdempotencyToken
+DISPATCH_DEDUPE_TTL = int(os.getenv("DISPATCH_DEDUPE_TTL", "300"))
+# seconds a claimed dispatch may take before an identical waiting one stops waiting for it and dispatches itself
+DISPATCH_CLAIM_TIMEOUT = int(os.getenv("DISPATCH_CLAIM_TIMEOUT", "60"))
+
+# batch dispatch (dispatch-batch)
+BATCH_DISPATCH_PARALLEL = int(os.getenv("BATCH_DISPATCH_PARALLEL", "10"))
+BATCH_DISPATCH_MAX_ITEMS = int(os.getenv("BATCH_DISPATCH_MAX_ITEMS", "1000"))
+BATCH_PARAMS = JUGGLER_PARAMS + ["timeout", "wait", "max_parallel"]
 
 # yes, remote fetching favicon can be a startup issue.
 FAVICON_URL = os.getenv("FAVICON_URL", "https://github.com/hashicorp/nomad/raw/refs/heads/main/ui/public/favicon.ico")
 FAVICON_PATH = "cached_favicon.ico"
+FAVICON_MAX_BYTES = int(os.getenv("FAVICON_MAX_BYTES", str(1024 * 1024)))
+FAVICON_ATTEMPTS = int(os.getenv("FAVICON_ATTEMPTS", "3"))  # background download attempts, backing off in between
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))  # Cache-Control max-age of pages and the favicon, seconds
+
+# tails are tracked in a small SQLite (WAL) database, shared by all worker processes on the host
+JOB_REGISTRY_PATH = os.getenv("JOB_REGISTRY_PATH", os.path.join(tempfile.gettempdir(), "nomad-juggler.sqlite"))
+JOB_REGISTRY_TTL = int(os.getenv("JOB_REGISTRY_TTL", "3600"))  # seconds a finished tail stays listed
+
+# requests taking longer than this (seconds) are logged with a per-phase breakdown, 0 disables
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "30"))
+
+# admission control of /api/ requests (per process, cancel and tails listing are never limited), 0 disables a limit.
+# Off by default: CI commonly holds 1000+ tails on one shared token, size the limits above your own load before enabling
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "0"))  # requests in flight overall
+ADMISSION_MAX_PER_TOKEN = int(os.getenv("ADMISSION_MAX_PER_TOKEN", "0"))
+ADMISSION_MAX_PER_NAMESPACE = int(os.getenv("ADMISSION_MAX_PER_NAMESPACE", "0"))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", "50"))  # requests waiting for a slot once ADMISSION_MAX_INFLIGHT is reached
+ADMISSION_QUEUE_SECONDS = float(os.getenv("ADMISSION_QUEUE_SECONDS", "5"))  # longest wait for a slot
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))  # Retry-After of a rejected request, seconds
+
+
+upstream_request_seconds = Histogram(
+    "juggler_upstream_request_seconds",
+    "Latency of Nomad API calls by operation (until the response headers for streams)",
+    ["op"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+upstream_responses = Counter("juggler_upstream_responses", "Nomad API responses by operation and status code", ["op", "code"])
+upstream_inflight = Gauge("juggler_upstream_inflight", "Nomad API calls in flight", ["op"])
+upstream_retries = Counter("juggler_upstream_retries", "Nomad API calls repeated after an error", ["op"])
+request_poll_iterations = Histogram(
+    "juggler_request_poll_iterations",
+    "Allocation list reads (polls and blocking queries) per request",
+    ["endpoint"],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 1000),
+)
+upstream_queue_seconds = Histogram(
+    "juggler_upstream_queue_seconds",
+    "Time Nomad calls waited for the upstream budget",
+    ["priority"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+# dispatched job lifecycle, observed by tails and batch waits; job is the parameterized (parent) job
+JOB_SECONDS_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200, 86400)
+job_placement_seconds = Histogram(
+    "juggler_job_placement_seconds", "Dispatch until the allocation was placed", ["job", "namespace"], buckets=JOB_SECONDS_BUCKETS
+)
+job_start_seconds = Histogram(
+    "juggler_job_start_seconds", "Allocation placed until its tasks were running", ["job", "namespace"], buckets=JOB_SECONDS_BUCKETS
+)
+job_run_seconds = Histogram("juggler_job_run_seconds", "Tasks running until finished", ["job", "namespace"], buckets=JOB_SECONDS_BUCKETS)
+job_outcomes = Counter("juggler_job_outcomes", "Dispatched jobs followed to the end, by outcome", ["job", "namespace", "outcome"])
+dispatch_dedupe = Counter("juggler_dispatch_dedupe", "Dispatch deduplication lookups", ["result"])
+upstream_rejected = Counter("juggler_upstream_rejected", "Nomad calls failed fast by an open circuit breaker", ["host"])
+admission_inflight = Gauge("juggler_admission_inflight", "Admitted /api/ requests in flight")
+admission_queue_depth = Gauge("juggler_admission_queue_depth", "Requests waiting for an admission slot")
+admission_rejections = Counter("juggler_admission_rejections", "Requests rejected by admission control", ["reason"])
+for reason in ("token", "namespace", "queue_full", "queue_timeout"):
+    admission_rejections.labels(reason)
+client_fallbacks = Counter("juggler_client_direct_fallbacks", "Client node calls sent through NOMAD_ADDR after the node failed", ["op"])
+upstream_backoff = Counter("juggler_upstream_backoff", "Nomad addresses paused after a 429/503 or Retry-After", ["host", "code"])
+inflight_waits = Gauge("juggler_inflight_waits", "Requests currently tailing or waiting on Nomad", ["kind"])
+for kind in ("tail", "stream", "restart", "status", "batch"):
+    inflight_waits.labels(kind)
+
+
+class RequestTrace:
+    """Where the time of one juggler request went: seconds and calls per phase, plus the number of polls.
+
+    Phases of concurrent work (parallel restarts, log fetches) add up, so they can exceed the wall time.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = {}
+        self.polls = 0
+        self.lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self.lock:
+            calls, total = self.phases.get(phase, (0, 0.0))
+            self.phases[phase] = (calls + 1, total + seconds)
+
+    def poll(self):
+        with self.lock:
+            self.polls += 1
+
+    def summary(self):
+        with self.lock:
+            return {phase: {"calls": calls, "seconds": round(total, 3)} for phase, (calls, total) in self.phases.items()}
+
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def traced_phase(phase):
+    started = time.time()
+    try:
+        yield
+    finally:
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add(phase, time.time() - started)
+
+
+def count_poll():
+    trace = current_trace.get()
+    if trace is not None:
+        trace.poll()
+
+
+def traced(fn):
+    # carry the caller's context (trace, region, call priority) into pool and reader threads, which start without it
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+call_priority = contextvars.ContextVar("call_priority", default=PRIORITY_INTERACTIVE)
+# federated region the current request targets (?region=, or one leg of a regions= fan-out), None is NOMAD_ADDR's own
+nomad_region = contextvars.ContextVar("nomad_region", default=None)
+
+
+@contextmanager
+def background_calls():
+    # Nomad calls made inside yield to interactive ones (dispatches, restarts, first reads) when the budget is short
+    reset = call_priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        call_priority.reset(reset)
+
+
+def backoff_delay(attempt, base=1.0, cap=NOMAD_BACKOFF_MAX):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class TokenBucket:
+    """Call budget of one Nomad address: rate calls per second with bursts up to burst.
+
+    Waiters are served by priority, then in arrival order. pause() holds every caller back (429/503/Retry-After from Nomad).
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.failures = 0
+        self.waiters = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority):
+        entry = (priority, next(self.seq))
+        with self.cond:
+            heapq.heappush(self.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self.waiters[0] == entry and now >= self.paused_until and (self.rate <= 0 or self.tokens >= 1):
+                        heapq.heappop(self.waiters)
+                        self.tokens -= 1
+                        self.cond.notify_all()
+                        return
+                    if self.waiters[0] != entry:
+                        # the head waiter wakes everyone up once it got through
+                        self.cond.wait(1.0)
+                    else:
+                        self.cond.wait(max(self.paused_until - now, 0 if self.rate <= 0 else (1 - self.tokens) / self.rate, 0.001))
+            except BaseException:
+                if entry in self.waiters:
+                    self.waiters.remove(entry)
+                    heapq.heapify(self.waiters)
+                    self.cond.notify_all()
+                raise
+
+    def pause(self, seconds):
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.cond.notify_all()
+
+    def failed(self, retry_after=None):
+        # seconds the address is paused: Retry-After when Nomad (or a proxy) sent one, backoff with jitter otherwise
+        with self.cond:
+            self.failures += 1
+            attempt = self.failures
+        delay = retry_after if retry_after is not None else backoff_delay(attempt - 1)
+        self.pause(min(delay, NOMAD_BACKOFF_MAX))
+        return delay
+
+    def succeeded(self):
+        if self.failures:
+            with self.cond:
+                self.failures = 0
+
+
+class UpstreamScheduler:
+    """Process wide token buckets and circuit breakers, one per Nomad address (servers now, client nodes too once called directly)."""
+
+    def __init__(self, rate=NOMAD_RATE_LIMIT, burst=NOMAD_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def upstream(self, url):
+        # (host, TokenBucket, CircuitBreaker)
+        parts = urllib.parse.urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+                self.breakers[host] = CircuitBreaker(host)
+            return host, self.buckets[host], self.breakers[host]
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    def __init__(self, host, retry_after):
+        super().__init__(f"Circuit breaker open for {host}, retry in {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """closed -> open after BREAKER_FAILURES consecutive failures or BREAKER_SLOW_CALLS consecutive slow calls,
+    open -> half_open after BREAKER_OPEN_SECONDS, where a single trial call decides between closed and open again.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.state = "closed"
+        self.failures = 0
+        self.slow_calls = 0
+        self.opened_at = 0.0
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def before_call(self, probe=False):
+        # raises CircuitOpenError while open; probes (health check) always go through and may close the breaker
+        with self.lock:
+            if self.state == "closed" or probe:
+                return
+            remaining = self.opened_at + BREAKER_OPEN_SECONDS - time.time()
+            if self.state == "open" and remaining <= 0:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.trial:
+                self.trial = True
+                return
+        upstream_rejected.labels(self.host).inc()
+        raise CircuitOpenError(self.host, max(remaining, 1.0))
+
+    def record(self, ok, elapsed=None):
+        # elapsed is only passed for calls that are expected to be quick
+        slow = elapsed is not None and elapsed > BREAKER_SLOW_SECONDS
+        with self.lock:
+            self.trial = False
+            self.failures = 0 if ok else self.failures + 1
+            self.slow_calls = self.slow_calls + 1 if slow else 0
+            tripped = self.failures >= BREAKER_FAILURES or (BREAKER_SLOW_CALLS and self.slow_calls >= BREAKER_SLOW_CALLS)
+            if self.state == "half_open":
+                tripped = not ok or slow
+            previous = self.state
+            if tripped:
+                self.state = "open"
+                self.opened_at = time.time()
+            elif ok and not slow:
+                self.state = "closed"
+        if self.state != previous:
+            logger.warning(
+                f"Circuit breaker {self.host} {previous} -> {self.state} (failures:{self.failures} slow_calls:{self.slow_calls})"
+            )
+
+    def status(self):
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.failures, "consecutive_slow_calls": self.slow_calls}
+
+
+def retry_after_seconds(resp):
+    value = resp.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        self.handshakes = getattr(self, "handshakes", 0) + 1
+        return super()._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        self.handshakes = getattr(self, "handshakes", 0) + 1
+        return super()._new_conn()
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    def __init__(self, socket_options=None, **kwargs):
+        self.socket_options = socket_options
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options is not None:
+            kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+
+
+class NomadClient:
+    """One requests.Session for every Nomad call, so connections (and TLS sessions) are reused per host.
+
+    Every call gets TIMEOUT unless the caller passes its own (blocking queries, streams), and is measured
+    under its op label (juggler_upstream_* metrics and the phases of the current request trace).
+    Calls wait for the upstream budget of their Nomad address first; a 429/503 (or any Retry-After) pauses that address
+    for everyone, GETs are repeated up to NOMAD_RETRIES times after a 429/5xx. While the address' circuit breaker
+    is open calls fail right away with CircuitOpenError.
+    """
+
+    def __init__(self, pool_size=NOMAD_POOL_SIZE, pool_hosts=NOMAD_POOL_HOSTS, keepalive=NOMAD_KEEPALIVE):
+        socket_options = list(HTTPConnection.default_socket_options)
+        if keepalive:
+            socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                socket_options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, NOMAD_KEEPALIVE_IDLE))
+        self.adapter = KeepAliveAdapter(socket_options=socket_options, pool_connections=pool_hosts, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        if not keepalive:
+            self.session.headers["Connection"] = "close"
+        self.evicted_handshakes = {}
+        self.adapter.poolmanager.pools.dispose_func = self._pool_evicted
+        self.scheduler = UpstreamScheduler()
+
+    def _pool_evicted(self, pool):
+        # keep the handshake counter monotonic when a host pool drops out of the LRU
+        host = f"{pool.scheme}://{pool.host}:{pool.port}"
+        self.evicted_handshakes[host] = self.evicted_handshakes.get(host, 0) + getattr(pool, "handshakes", 0)
+        pool.close()
+
+    def request(self, method, url, timeout=None, op="other", priority=None, probe=False, **kwargs):
+        priority = call_priority.get() if priority is None else priority
+        if nomad_region.get():
+            kwargs["params"] = {"region": nomad_region.get(), **(kwargs.get("params") or {})}
+        host, bucket, breaker = self.scheduler.upstream(url)
+        attempts = 1 + (NOMAD_RETRIES if method == "GET" else 0)
+        for attempt in range(attempts):
+            breaker.before_call(probe)
+            # recorded exactly once, whatever raises in between (eg. the bucket) counts as a failure and frees a half-open trial
+            ok, elapsed = False, None
+            try:
+                queued = time.time()
+                bucket.acquire(priority)
+                waited = time.time() - queued
+                upstream_queue_seconds.labels(PRIORITY_NAMES[priority]).observe(waited)
+                trace = current_trace.get()
+                if trace is not None and waited > 0.001:
+                    trace.add("queue", waited)
+
+                started = time.time()
+                try:
+                    resp = self._send(method, url, timeout or TIMEOUT, op, kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    raise
+                except requests.exceptions.RequestException:
+                    ok = True
+                    raise
+                ok = resp.status_code not in BREAKER_FAILURE_CODES
+                # blocking queries and streams pass their own timeout, only default timeout calls are expected to be quick
+                elapsed = time.time() - started if timeout is None else None
+            finally:
+                breaker.record(ok, elapsed)
+            if resp.status_code != 429 and resp.status_code < 500:
+                bucket.succeeded()
+                return resp
+            retry_after = retry_after_seconds(resp)
+            retry = attempt + 1 < attempts
+            if resp.status_code in (429, 503) or retry_after is not None:
+                # the address asked for a break, hold back every caller
+                delay = bucket.failed(retry_after)
+                upstream_backoff.labels(host, str(resp.status_code)).inc()
+                logger.warning(f"Nomad {host} answered {op} with {resp.status_code}, pausing calls for {delay:.1f}s")
+            elif retry:
+                # an error of this call only (eg. an RPC error), the address stays open and just this GET backs off
+                delay = backoff_delay(attempt)
+                logger.warning(f"Nomad {host} answered {op} with {resp.status_code}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+            if retry:
+                upstream_retries.labels(op).inc()
+                resp.close()
+        return resp
+
+    def _send(self, method, url, timeout, op, kwargs):
+        code = "error"
+        started = time.time()
+        upstream_inflight.labels(op).inc()
+        try:
+            resp = self.session.request(method, url, timeout=timeout, **kwargs)
+            code = str(resp.status_code)
+            return resp
+        finally:
+            elapsed = time.time() - started
+            upstream_inflight.labels(op).dec()
+            upstream_request_seconds.labels(op).observe(elapsed)
+            upstream_responses.labels(op, code).inc()
+            trace = current_trace.get()
+            if trace is not None:
+                trace.add(f"nomad:{op}", elapsed)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def pool_stats(self):
+        stats = {host: {"in_use": 0, "idle": 0, "handshakes": count} for host, count in self.evicted_handshakes.items()}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            entry = stats.setdefault(host, {"in_use": 0, "idle": 0, "handshakes": 0})
+            entry["handshakes"] += getattr(pool, "handshakes", 0)
+            if pool.pool is not None:
+                queued = list(pool.pool.queue)
+                entry["idle"] += sum(1 for conn in queued if conn is not None)
+                entry["in_use"] += pool.pool.maxsize - len(queued)
+        return stats
+
+
+class NomadPoolCollector:
+    def __init__(self, client):
+        self.client = client
+
+    def collect(self):
+        connections = GaugeMetricFamily("juggler_upstream_pool_connections", "Pooled connections towards Nomad", labels=["host", "state"])
+        handshakes = CounterMetricFamily("juggler_upstream_pool_handshakes", "New connections opened towards Nomad", labels=["host"])
+        for host, entry in self.client.pool_stats().items():
+            connections.add_metric([host, "in_use"], entry["in_use"])
+            connections.add_metric([host, "idle"], entry["idle"])
+            handshakes.add_metric([host], entry["handshakes"])
+        breakers = GaugeMetricFamily(
+            "juggler_upstream_breaker_open", "Circuit breaker state (0 closed, 0.5 half open, 1 open)", labels=["host"]
+        )
+        for host, breaker in list(self.client.scheduler.breakers.items()):
+            breakers.add_metric([host], {"closed": 0, "half_open": 0.5, "open": 1}[breaker.state])
+        yield connections
+        yield handshakes
+        yield breakers
+
+
+nomad = NomadClient()
+REGISTRY.register(NomadPoolCollector(nomad))
+
+
+def token_digest(token):
+    # tokens never end up as cache keys or in memory dumps in plain text
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+alloc_cache_requests = Counter("juggler_alloc_cache_requests", "Allocation list cache lookups", ["result"])
+alloc_cache_evictions = Counter("juggler_alloc_cache_evictions", "Allocation lists evicted from the cache")
+alloc_cache_bytes = Gauge("juggler_alloc_cache_bytes", "Approximate size of the cached allocation lists")
+for result in ("hit", "miss", "coalesced"):
+    alloc_cache_requests.labels(result)
+
+
+class InFlight:
+    def __init__(self):
+        self.started = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AllocListCache:
+    """Allocation lists per (token, namespace, job) keyed on X-Nomad-Index.
+
+    Concurrent identical fetches share one upstream call (single flight), results are served for ALLOC_CACHE_TTL
+    seconds and a newer index (from a blocking query) replaces an entry early. Least recently used entries are
+    evicted beyond ALLOC_CACHE_MAX_ENTRIES / ALLOC_CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, ttl=ALLOC_CACHE_TTL, max_bytes=ALLOC_CACHE_MAX_BYTES, max_entries=ALLOC_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (stored_at, index, allocations, size)
+        self.inflight = {}
+        self.size = 0
+
+    def _store(self, key, allocations, index, size):
+        current = self.entries.get(key)
+        if current is not None:
+            if current[1] > index:
+                return
+            self.size -= current[3]
+        self.entries[key] = (time.time(), index, allocations, size)
+        self.entries.move_to_end(key)
+        self.size += size
+        while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted[3]
+            alloc_cache_evictions.inc()
+        alloc_cache_bytes.set(self.size)
+
+    def store(self, key, allocations, index, size):
+        with self.lock:
+            self._store(key, allocations, index, size)
+
+    def invalidate(self, namespace, job):
+        with self.lock:
+            for key in [key for key in self.entries if key[1:3] == (namespace, job)]:
+                self.size -= self.entries.pop(key)[3]
+            alloc_cache_bytes.set(self.size)
+
+    def get(self, key, fetch, fresh_since=None):
+        """fetch() -> (allocations, index, size).
+
+        fresh_since (a timestamp) skips the cached entry and only shares a running fetch that started after it,
+        an older one may not have seen what the caller is after.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if fresh_since is None and entry is not None and time.time() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                alloc_cache_requests.labels("hit").inc()
+                return entry[2], entry[1]
+            flight = self.inflight.get(key)
+            if flight is None or (fresh_since is not None and flight.started < fresh_since):
+                # later callers join the newest fetch
+                flight = self.inflight[key] = InFlight()
+                leader = True
+                alloc_cache_requests.labels("miss").inc()
+            else:
+                leader = False
+                alloc_cache_requests.labels("coalesced").inc()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            allocations, index, size = fetch()
+            flight.result = (allocations, index)
+            with self.lock:
+                if self.ttl > 0:
+                    self._store(key, allocations, index, size)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.inflight.get(key) is flight:
+                    del self.inflight[key]
+            flight.done.set()
+
+
+alloc_cache = AllocListCache()
+
+
+def alloc_cache_key(token, namespace, job):
+    return (token_digest(token), namespace, job, nomad_region.get())
+
+
+def list_job_allocations(token, namespace, job, fresh_since=None):
+    # (allocations, X-Nomad-Index) of a job, through the allocation list cache
+    url = f"{NOMAD_ADDR}/v1/job/{urllib.parse.quote(job, safe='')}/allocations?namespace={namespace}"
+
+    def fetch():
+        count_poll()
+        resp = nomad.get(url, headers={"X-Nomad-Token": token}, op="job_allocations")
+        resp.raise_for_status()
+        return resp.json(), int(resp.headers.get("X-Nomad-Index", 0)), len(resp.content)
+
+    return alloc_cache.get(alloc_cache_key(token, namespace, job), fetch, fresh_since=fresh_since)
+
+
+def job_exists(token, namespace, job):
+    # False only when Nomad says there is no such job, other errors raise
+    url = f"{NOMAD_ADDR}/v1/job/{urllib.parse.quote(job, safe='')}?namespace={namespace}"
+    resp = nomad.get(url, headers={"X-Nomad-Token": token}, op="job")
+    if resp.status_code == 404:
+        return False
+    resp.raise_for_status()
+    return True
 
 
-# Shared cancel signals
-cancel_flags = {}
+def filter_string(value):
+    # quoted string literal of a Nomad filter expression
+    return json.dumps(value, ensure_ascii=False)
 
 
-def cache_favicon():
-    if not os.path.exists(FAVICON_PATH):
+def filter_any(selector, values):
+    return "(" + " or ".join(f"{selector} == {filter_string(value)}" for value in values) + ")"
+
+
+def list_running_allocations(token, namespace, job, task_name=None, nodes=()):
+    """(allocations, X-Nomad-Index) of the job's running allocations, optionally with task_name and on nodes (names or IDs).
+
+    Nomad filters (ClientStatus, task presence, node) so completed/failed history never gets transferred or parsed.
+    Callers still check what they need: with ALLOC_LIST_FILTER=false or a filter Nomad rejects this is the whole job list.
+    """
+    if not ALLOC_LIST_FILTER:
+        return list_job_allocations(token, namespace, job)
+    expression = f'JobID == {filter_string(job)} and ClientStatus == "running"'
+    if task_name:
+        expression += f" and {filter_string(task_name)} in TaskStates"
+    if nodes:
+        expression += f" and ({filter_any('NodeName', nodes)} or {filter_any('NodeID', nodes)})"
+    url = f"{NOMAD_ADDR}/v1/allocations"
+
+    def fetch():
+        count_poll()
+        resp = nomad.get(
+            url, headers={"X-Nomad-Token": token}, params={"namespace": namespace, "filter": expression}, op="job_allocations_filtered"
+        )
+        resp.raise_for_status()
+        return resp.json(), int(resp.headers.get("X-Nomad-Index", 0)), len(resp.content)
+
+    try:
+        return alloc_cache.get(alloc_cache_key(token, namespace, job) + (expression,), fetch)
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code != 400:
+            raise
+        logger.warning(f"Nomad rejected the allocation filter ({e.response.text.strip()}), listing all allocations of {job}")
+        return list_job_allocations(token, namespace, job)
+
+
+def list_node_ids(token, datacenters=(), node_pools=()):
+    # IDs of the client nodes in any of datacenters and any of node_pools, filtered by Nomad and checked again here (needs node:read)
+    expression = " and ".join(
+        filter_any(selector, values) for selector, values in (("Datacenter", datacenters), ("NodePool", node_pools)) if values
+    )
+    resp = nomad.get(f"{NOMAD_ADDR}/v1/nodes", headers={"X-Nomad-Token": token}, params={"filter": expression}, op="nodes")
+    resp.raise_for_status()
+    return {
+        node["ID"]
+        for node in resp.json()
+        if (not datacenters or node.get("Datacenter") in datacenters) and (not node_pools or node.get("NodePool") in node_pools)
+    }
+
+
+acl_cache_requests = Counter("juggler_acl_cache_requests", "Token capability cache lookups", ["result"])
+acl_rejections = Counter("juggler_acl_rejections", "Requests rejected by the token capability pre-check", ["capability"])
+for result in ("hit", "miss", "coalesced"):
+    acl_cache_requests.labels(result)
+
+# capabilities behind Nomad's namespace policy shorthands (nomad/acl/policy.go), only what juggler checks matters
+POLICY_CAPABILITIES = {
+    "deny": {"deny"},
+    "read": {"list-jobs", "parse-job", "read-job", "read-job-scaling", "list-scaling-policies", "read-scaling-policy"},
+    "write": {
+        "list-jobs",
+        "parse-job",
+        "read-job",
+        "read-job-scaling",
+        "list-scaling-policies",
+        "read-scaling-policy",
+        "scale-job",
+        "submit-job",
+        "dispatch-job",
+        "read-logs",
+        "read-fs",
+        "alloc-exec",
+        "alloc-lifecycle",
+    },
+    "scale": {"list-scaling-policies", "read-scaling-policy", "read-job-scaling", "scale-job"},
+}
+
+
+def hcl_block_body(text, start):
+    # top level content of the block opening before text[start], nested blocks left out
+    depth = 1
+    body = []
+    for i in range(start, len(text)):
+        char = text[i]
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return "".join(body)
+        elif depth == 1:
+            body.append(char)
+    return None
+
+
+def parse_namespace_rules(rules):
+    """{namespace (glob): capabilities} out of a policy's HCL rules, None when they cannot be read reliably (JSON rules)."""
+    rules = re.sub(r"(?m)^\s*(#|//).*$", "", rules or "")
+    namespaces = {}
+    for match in re.finditer(r'namespace\s+"([^"]*)"\s*\{', rules):
+        body = hcl_block_body(rules, match.end())
+        if body is None:
+            return None
+        capabilities = set()
+        policy = re.search(r'\bpolicy\s*=\s*"([^"]+)"', body)
+        if policy:
+            capabilities |= POLICY_CAPABILITIES.get(policy.group(1), set())
+        listed = re.search(r"\bcapabilities\s*=\s*\[([^\]]*)\]", body)
+        if listed:
+            capabilities |= set(re.findall(r'"([^"]+)"', listed.group(1)))
+        namespaces.setdefault(match.group(1), set()).update(capabilities)
+    if not namespaces and re.search(r"\bnamespace\b", rules):
+        return None
+    return namespaces
+
+
+class TokenCapabilities:
+    """What a token may do per namespace. allows() is True/False, or None when juggler cannot tell (Nomad decides)."""
+
+    def __init__(self, valid=True, management=False, namespaces=None, complete=True):
+        self.valid = valid
+        self.management = management
+        self.namespaces = namespaces or {}
+        self.complete = complete
+
+    def allows(self, namespace, capability):
+        if self.management:
+            return True
+        if not self.valid:
+            return False
+        capabilities = self.namespaces.get(namespace)
+        if capabilities is None:
+            # the closest glob wins, like in Nomad: the one with the fewest characters left to the wildcard
+            globs = [glob for glob in self.namespaces if fnmatch.fnmatchcase(namespace, glob)]
+            if globs:
+                capabilities = self.namespaces[min(globs, key=lambda glob: len(namespace) - len(glob.replace("*", "")))]
+        if capabilities and "deny" not in capabilities and capability in capabilities:
+            return True
+        return False if self.complete else None
+
+
+class TokenCapabilityCache:
+    """Token capabilities keyed by (token hash, region), ACL_CACHE_TTL seconds, least recently used evicted.
+
+    Concurrent lookups of one token share the upstream calls. Anything juggler cannot read (roles or policies it
+    may not fetch, unparseable rules, Nomad errors) fails open, so Nomad stays the one enforcing the ACLs.
+    """
+
+    def __init__(self, ttl=ACL_CACHE_TTL, max_entries=ACL_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (stored_at, TokenCapabilities)
+        self.inflight = {}
+
+    def get(self, token):
+        key = (token_digest(token), nomad_region.get())
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                acl_cache_requests.labels("hit").inc()
+                return entry[1]
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = InFlight()
+            acl_cache_requests.labels("miss" if leader else "coalesced").inc()
+
+        if not leader:
+            flight.done.wait()
+            # the leader failed in a way lookup() did not catch, fail open as well
+            return flight.result or TokenCapabilities(complete=False)
+
+        try:
+            flight.result, cacheable = self.lookup(token)
+            if cacheable:
+                with self.lock:
+                    self.entries[key] = (time.time(), flight.result)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+            return flight.result
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight.done.set()
+
+    def lookup(self, token):
+        # (TokenCapabilities, cacheable); any error on the way (connection, open breaker, bad JSON) fails open, uncached
+        try:
+            return self._lookup(token)
+        except Exception as e:
+            logger.debug(f"ACL lookup failed: {e}")
+            return TokenCapabilities(complete=False), False
+
+    def _lookup(self, token):
+        headers = {"X-Nomad-Token": token}
+        resp = nomad.get(f"{NOMAD_ADDR}/v1/acl/token/self", headers=headers, op="acl")
+        if resp.status_code == 403:
+            return TokenCapabilities(valid=False), True
+        if resp.status_code != 200:
+            # ACLs disabled (400 "ACL support disabled") means everything is allowed, server errors are not cached
+            return TokenCapabilities(management="disabled" in resp.text.lower(), complete=False), resp.status_code < 500
+        acl_token = resp.json()
+        if acl_token.get("Type") == "management":
+            return TokenCapabilities(management=True), True
+
+        policies = set(acl_token.get("Policies") or [])
+        complete = True
+        for role in acl_token.get("Roles") or []:
+            role_resp = nomad.get(f"{NOMAD_ADDR}/v1/acl/role/{role.get('ID')}", headers=headers, op="acl")
+            if role_resp.status_code != 200:
+                complete = False
+                continue
+            policies |= {policy.get("Name") for policy in role_resp.json().get("Policies") or []}
+
+        namespaces = {}
+        for name in sorted(policies):
+            policy_resp = nomad.get(f"{NOMAD_ADDR}/v1/acl/policy/{urllib.parse.quote(name, safe='')}", headers=headers, op="acl")
+            rules = parse_namespace_rules(policy_resp.json().get("Rules")) if policy_resp.status_code == 200 else None
+            if rules is None:
+                complete = False
+                continue
+            for namespace, capabilities in rules.items():
+                namespaces.setdefault(namespace, set()).update(capabilities)
+        return TokenCapabilities(namespaces=namespaces, complete=complete), True
+
+
+acl_cache = TokenCapabilityCache()
+
+
+def require_capability(token, namespace, capability):
+    # None when the request may go on, otherwise the 403 answer; a rejected request never touched the job
+    if not ACL_PRECHECK:
+        return None
+    capabilities = acl_cache.get(token)
+    if capabilities.allows(namespace, capability) is not False:
+        return None
+    acl_rejections.labels(capability).inc()
+    if not capabilities.valid:
+        return jsonify({"error": "ACL token not found"}), 403
+    return jsonify({"error": f"Permission denied: token lacks {capability} on namespace {namespace}"}), 403
+
+
+class AdmissionControl:
+    """Caps /api/ requests in flight: overall, per token and per namespace.
+
+    Over a token or namespace quota a request is rejected right away, waiting would only let one caller crowd out the others.
+    Over ADMISSION_MAX_INFLIGHT up to ADMISSION_QUEUE requests wait (first come first served) for ADMISSION_QUEUE_SECONDS.
+    """
+
+    ERRORS = {
+        "token": "Too many concurrent requests for this token (ADMISSION_MAX_PER_TOKEN)",
+        "namespace": "Too many concurrent requests in this namespace (ADMISSION_MAX_PER_NAMESPACE)",
+        "queue_full": "Too many concurrent requests, admission queue full (ADMISSION_MAX_INFLIGHT/ADMISSION_QUEUE)",
+        "queue_timeout": "Too many concurrent requests, no slot freed up in time (ADMISSION_MAX_INFLIGHT/ADMISSION_QUEUE_SECONDS)",
+    }
+
+    def __init__(
+        self,
+        max_inflight=ADMISSION_MAX_INFLIGHT,
+        max_per_token=ADMISSION_MAX_PER_TOKEN,
+        max_per_namespace=ADMISSION_MAX_PER_NAMESPACE,
+        queue_size=ADMISSION_QUEUE,
+        queue_seconds=ADMISSION_QUEUE_SECONDS,
+    ):
+        self.max_inflight = max_inflight
+        self.max_per_token = max_per_token
+        self.max_per_namespace = max_per_namespace
+        self.queue_size = queue_size
+        self.queue_seconds = queue_seconds
+        self.cond = threading.Condition()
+        self.inflight = 0
+        self.per_token = {}  # token digest -> requests in flight
+        self.per_namespace = {}
+        self.waiting = deque()
+
+    def _over_quota(self, token_hash, namespace):
+        if self.max_per_token and self.per_token.get(token_hash, 0) >= self.max_per_token:
+            return "token"
+        if self.max_per_namespace and self.per_namespace.get(namespace, 0) >= self.max_per_namespace:
+            return "namespace"
+        return None
+
+    def admit(self, token_hash, namespace):
+        # None once admitted (release() when done), otherwise the reason of the rejection
+        with self.cond:
+            reason = self._over_quota(token_hash, namespace)
+            if reason:
+                return reason
+            if self.max_inflight and (self.inflight >= self.max_inflight or self.waiting):
+                if len(self.waiting) >= self.queue_size:
+                    return "queue_full"
+                ticket = object()
+                self.waiting.append(ticket)
+                admission_queue_depth.set(len(self.waiting))
+                try:
+                    with traced_phase("admission_queue"):
+                        admitted = self.cond.wait_for(
+                            lambda: self.waiting[0] is ticket and self.inflight < self.max_inflight, timeout=self.queue_seconds
+                        )
+                finally:
+                    self.waiting.remove(ticket)
+                    admission_queue_depth.set(len(self.waiting))
+                    self.cond.notify_all()
+                if not admitted:
+                    return "queue_timeout"
+                reason = self._over_quota(token_hash, namespace)
+                if reason:
+                    return reason
+            self.inflight += 1
+            self.per_token[token_hash] = self.per_token.get(token_hash, 0) + 1
+            self.per_namespace[namespace] = self.per_namespace.get(namespace, 0) + 1
+            admission_inflight.set(self.inflight)
+            return None
+
+    def release(self, token_hash, namespace):
+        with self.cond:
+            self.inflight -= 1
+            for counts, key in ((self.per_token, token_hash), (self.per_namespace, namespace)):
+                counts[key] -= 1
+                if not counts[key]:
+                    del counts[key]
+            admission_inflight.set(self.inflight)
+            self.cond.notify_all()
+
+
+admission = AdmissionControl()
+
+
+class JobRegistry:
+    """Open tails, shared across worker processes so cancel/listing work whichever worker receives the call.
+
+    Rows expire JOB_REGISTRY_TTL seconds after the tail finished, or after its timeout when a worker died mid tail.
+    """
+
+    ACTIVE = ("dispatched", "running")
+
+    def __init__(self, path=JOB_REGISTRY_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        self.pid = None
+
+    def _conn(self):
+        # connections must not cross a fork (gunicorn --preload), reconnect per process
+        if self.db is None or self.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS tails (
+                    id TEXT PRIMARY KEY, token_hash TEXT, namespace TEXT, job TEXT, dispatched_job_id TEXT,
+                    status TEXT, cancel_requested INTEGER DEFAULT 0, pid INTEGER, started REAL, updated REAL, expires REAL)""")
+            db.execute("CREATE INDEX IF NOT EXISTS tails_owner ON tails (token_hash, namespace, job)")
+            db.execute("CREATE INDEX IF NOT EXISTS tails_expires ON tails (expires)")
+            db.execute("CREATE TABLE IF NOT EXISTS dispatches (key TEXT PRIMARY KEY, dispatched_job_id TEXT, expires REAL)")
+            self.db, self.pid = db, os.getpid()
+        return self.db
+
+    def execute(self, sql, args=()):
+        with self.lock:
+            cursor = self._conn().execute(sql, args)
+            return cursor.fetchall(), cursor.rowcount
+
+    def register(self, token, namespace, job, dispatched_job_id, timeout):
+        now = time.time()
+        tail_id = uuid.uuid4().hex
+        self.execute("DELETE FROM tails WHERE expires < ?", (now,))
+        self.execute(
+            "INSERT INTO tails (id, token_hash, namespace, job, dispatched_job_id, status, pid, started, updated, expires) "
+            "VALUES (?, ?, ?, ?, ?, 'dispatched', ?, ?, ?, ?)",
+            (tail_id, token_digest(token), namespace, job, dispatched_job_id, os.getpid(), now, now, now + timeout + JOB_REGISTRY_TTL),
+        )
+        return tail_id
+
+    def set_status(self, tail_id, status):
+        self.execute("UPDATE tails SET status = ?, updated = ? WHERE id = ?", (status, time.time(), tail_id))
+
+    def finish(self, tail_id, status):
+        now = time.time()
+        self.execute("UPDATE tails SET status = ?, updated = ?, expires = ? WHERE id = ?", (status, now, now + JOB_REGISTRY_TTL, tail_id))
+
+    def cancel(self, token, namespace, job):
+        # flags every open tail of the job, returns how many
+        _, count = self.execute(
+            "UPDATE tails SET cancel_requested = 1, updated = ? WHERE token_hash = ? AND namespace = ? AND job = ? AND status IN (?, ?)",
+            (time.time(), token_digest(token), namespace, job, *self.ACTIVE),
+        )
+        return count
+
+    def cancel_requested(self, tail_id):
+        rows, _ = self.execute("SELECT cancel_requested FROM tails WHERE id = ?", (tail_id,))
+        return bool(rows and rows[0][0])
+
+    def any_cancel_requested(self, tail_ids):
+        if not tail_ids:
+            return False
+        rows, _ = self.execute(
+            f"SELECT 1 FROM tails WHERE cancel_requested = 1 AND id IN ({','.join('?' * len(tail_ids))}) LIMIT 1", tail_ids
+        )
+        return bool(rows)
+
+    def claim_dispatch(self, key):
+        """(True, None) when the caller claimed the key and dispatches, otherwise (False, DispatchedJobID of the earlier
+        identical dispatch or None while that one is still being dispatched).
+
+        The claim is a single INSERT OR IGNORE, so of concurrent identical dispatches (any worker) only one wins.
+        """
+        now = time.time()
+        self.execute("DELETE FROM dispatches WHERE expires < ?", (now,))
+        _, claimed = self.execute("INSERT OR IGNORE INTO dispatches VALUES (?, NULL, ?)", (key, now + DISPATCH_CLAIM_TIMEOUT))
+        if claimed:
+            return True, None
+        rows, _ = self.execute("SELECT dispatched_job_id FROM dispatches WHERE key = ?", (key,))
+        return False, rows[0][0] if rows else None
+
+    def remember_dispatch(self, key, dispatched_job_id):
+        self.execute("INSERT OR REPLACE INTO dispatches VALUES (?, ?, ?)", (key, dispatched_job_id, time.time() + DISPATCH_DEDUPE_TTL))
+
+    def release_dispatch(self, key):
+        # the claimed dispatch failed, the next identical one may try again
+        self.execute("DELETE FROM dispatches WHERE key = ? AND dispatched_job_id IS NULL", (key,))
+
+    def knows_dispatch(self, dispatched_job_id):
+        # dispatched (and tailed or deduplicated) through juggler, recently enough to still have a row
+        rows, _ = self.execute(
+            "SELECT 1 FROM tails WHERE dispatched_job_id = ? UNION ALL SELECT 1 FROM dispatches WHERE dispatched_job_id = ? LIMIT 1",
+            (dispatched_job_id, dispatched_job_id),
+        )
+        return bool(rows)
+
+    def list(self, token, namespace, job=None):
+        sql = "SELECT id, job, dispatched_job_id, status, cancel_requested, pid, started, updated FROM tails "
+        sql += "WHERE token_hash = ? AND namespace = ? AND expires >= ?"
+        args = [token_digest(token), namespace, time.time()]
+        if job:
+            sql += " AND job = ?"
+            args.append(job)
+        rows, _ = self.execute(sql + " ORDER BY started", args)
+        fields = ("id", "job", "dispatched_job_id", "status", "cancel_requested", "worker_pid", "started", "updated")
+        return [dict(zip(fields, row), cancel_requested=bool(row[4])) for row in rows]
+
+
+registry = JobRegistry()
+
+
+class StaticAssets:
+    """Pages and assets rendered once, served from memory with ETag/Last-Modified (and 304s for revalidations)."""
+
+    def __init__(self):
+        self.assets = {}
+
+    def put(self, name, body, mimetype):
+        body = body.encode() if isinstance(body, str) else body
+        modified = datetime.now(timezone.utc).replace(microsecond=0)
+        self.assets[name] = (body, mimetype, hashlib.sha256(body).hexdigest()[:32], modified)
+
+    def serve(self, name):
+        asset = self.assets.get(name)
+        if asset is None:
+            return "", 404
+        body, mimetype, etag, modified = asset
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        response.last_modified = modified
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        return response.make_conditional(request)
+
+
+static_assets = StaticAssets()
+
+
+def prefetch_favicon():
+    # background task: the on-disk copy when there is one, otherwise a bounded download; requests never wait for it
+    if os.path.exists(FAVICON_PATH):
+        with open(FAVICON_PATH, "rb") as f:
+            static_assets.put("favicon", f.read(FAVICON_MAX_BYTES), "image/vnd.microsoft.icon")
+        return
+    for attempt in range(FAVICON_ATTEMPTS):
+        if attempt:
+            time.sleep(backoff_delay(attempt, base=2.0))
         try:
-            response = requests.get(FAVICON_URL)
-            response.raise_for_status()
+            with requests.get(FAVICON_URL, timeout=TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                content = response.raw.read(FAVICON_MAX_BYTES + 1, decode_content=True)
+            if len(content) > FAVICON_MAX_BYTES:
+                logger.error(f"Favicon {FAVICON_URL} exceeds FAVICON_MAX_BYTES:{FAVICON_MAX_BYTES}")
+                return
+            static_assets.put("favicon", content, "image/vnd.microsoft.icon")
             with open(FAVICON_PATH, "wb") as f:
-                f.write(response.content)
+                f.write(content)
             logger.info(
-                f"Favicon downloaded {FAVICON_URL} and cached:{FAVICON_PATH} status_code:{response.status_code} size:{len(response.content)}"
+                f"Favicon downloaded {FAVICON_URL} and cached:{FAVICON_PATH} status_code:{response.status_code} size:{len(content)}"
             )
+            return
         except Exception as e:
-            logger.error(f"Failed to download favicon ({FAVICON_URL}): {e}")
+            logger.error(f"Failed to download favicon ({FAVICON_URL}) attempt {attempt + 1}/{FAVICON_ATTEMPTS}: {e}")
 
 
 def timestamped_message(message):
@@ -87,35 +1403,915 @@ def timestamped_message(message):
     return f"nomad-juggler: {ts} {message}\n"
 
 
+def parse_duration(value, default=0.0):
+    # accepts Nomad style durations ("500ms", "5s", "2m") or plain seconds ("5", "0.5")
+    if value is None or value == "":
+        return float(default)
+    value = str(value).strip().lower()
+    for suffix, factor in (("ms", 0.001), ("s", 1), ("m", 60), ("h", 3600)):
+        if value.endswith(suffix):
+            return float(value[: -len(suffix)]) * factor
+    return float(value)
+
+
+def int_param(name, value, default, lowest, highest):
+    # integer query parameter clamped to lowest..highest, ValueError naming the parameter when it is not a number
+    if value is None or value == "":
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from None
+    return min(max(number, lowest), highest)
+
+
+def group_by_node(allocs):
+    # NodeID -> allocations, in the order the nodes were first seen
+    nodes = OrderedDict()
+    for alloc in allocs:
+        nodes.setdefault(alloc.get("NodeID"), []).append(alloc)
+    return nodes
+
+
+def iter_restarts(allocs, restart_fn, max_parallel=1, per_node_parallel=1, batch_size=0, batch_pause=0.0):
+    """Run restart_fn over allocs and yield (alloc, result) as each one completes.
+
+    At most max_parallel restarts are in flight overall and at most per_node_parallel per NodeID,
+    so a single Docker daemon never receives a restart storm. With batch_size set, allocations are
+    handled in batches of that size with batch_pause seconds between them (rolling restart).
+    """
+    max_parallel = max(1, max_parallel)
+    per_node_parallel = max(1, per_node_parallel)
+    allocs = list(allocs)
+    batch_size = batch_size if batch_size > 0 else max(len(allocs), 1)
+
+    with ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="restart") as pool:
+        for start in range(0, len(allocs), batch_size):
+            if start and batch_pause > 0:
+                with traced_phase("batch_pause"):
+                    time.sleep(batch_pause)
+
+            pending = group_by_node(allocs[start : start + batch_size])
+            node_inflight = {node_id: 0 for node_id in pending}
+            running = {}
+
+            while pending or running:
+                # fill free slots round-robin over the nodes that still have work and spare per-node capacity
+                progressed = True
+                while progressed and len(running) < max_parallel:
+                    progressed = False
+                    for node_id in list(pending):
+                        if len(running) >= max_parallel:
+                            break
+                        if node_inflight[node_id] >= per_node_parallel:
+                            continue
+                        alloc = pending[node_id].pop(0)
+                        if not pending[node_id]:
+                            del pending[node_id]
+                        node_inflight[node_id] += 1
+                        running[pool.submit(traced(restart_fn), alloc)] = alloc
+                        progressed = True
+
+                done, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    alloc = running.pop(future)
+                    node_inflight[alloc.get("NodeID")] -= 1
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {"ok": False, "error": str(e)}
+                    yield alloc, result
+
+
+def task_restart_marks(alloc, tasks):
+    # (Restarts, LastRestart) per task, compared before/after to tell that a task really went through a restart
+    task_states = alloc.get("TaskStates") or {}
+    return {task: ((task_states.get(task) or {}).get("Restarts", 0), (task_states.get(task) or {}).get("LastRestart")) for task in tasks}
+
+
+def alloc_restarted(alloc, baseline):
+    # ready once the alloc is running again and every task that was restarted is running with a newer restart mark
+    if alloc.get("ClientStatus") != "running":
+        return False
+    task_states = alloc.get("TaskStates") or {}
+    for task, (restarts, last_restart) in baseline.items():
+        state = task_states.get(task) or {}
+        if state.get("State") != "running":
+            return False
+        if state.get("Restarts", 0) <= restarts and state.get("LastRestart") == last_restart:
+            return False
+    return True
+
+
+def iter_restart_readiness(list_allocs, baselines, index, deadline):
+    """Follow the job's allocation list with Nomad blocking queries and yield (event, alloc_id, alloc).
+
+    event is "ready" once alloc_restarted() holds for the alloc, or "gone" when it turned terminal or
+    disappeared. list_allocs(index, wait) must return (allocations, X-Nomad-Index). Stops when every
+    alloc in baselines is settled or the deadline passes.
+    """
+    pending = dict(baselines)
+    while pending:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        allocations, new_index = list_allocs(index, min(remaining, BLOCKING_QUERY_WAIT))
+        # the index can move backwards after a leader election, restart the blocking query from scratch then
+        index = new_index if new_index >= index else 0
+        seen = set()
+        for alloc in allocations:
+            alloc_id = alloc.get("ID")
+            if alloc_id not in pending:
+                continue
+            seen.add(alloc_id)
+            if alloc_restarted(alloc, pending[alloc_id]):
+                del pending[alloc_id]
+                yield "ready", alloc_id, alloc
+            elif alloc.get("ClientStatus") in ("complete", "failed", "lost"):
+                del pending[alloc_id]
+                yield "gone", alloc_id, alloc
+        for alloc_id in [alloc_id for alloc_id in pending if alloc_id not in seen]:
+            del pending[alloc_id]
+            yield "gone", alloc_id, None
+
+
+class JobWatch:
+    """Latest known allocations of one job, updated by the event stream and read by the waiting request."""
+
+    def __init__(self, job_id, cond=None):
+        self.job_id = job_id
+        self.allocs = {}
+        self.job = None
+        # watches waited on together (batch dispatch) share one condition
+        self.cond = cond or threading.Condition()
+        self.subscription = None
+        self.stale = True
+        self.stale_since = time.time()  # a stale watch needs a list read that started after this
+        self.last_poll = 0
+        self.poll_interval = POLL_INTERVAL
+        self.next_poll = 0
+
+    def update_alloc(self, alloc):
+        with self.cond:
+            self.allocs[alloc["ID"]] = alloc
+            self.cond.notify_all()
+
+    def update_job(self, job):
+        with self.cond:
+            self.job = job
+            self.cond.notify_all()
+
+    def refresh(self, allocations):
+        # True when the read brought anything new
+        changed = False
+        with self.cond:
+            for alloc in allocations:
+                known = self.allocs.get(alloc["ID"])
+                # a (cached) list read can be older than what the event stream already delivered
+                if known is not None and alloc.get("ModifyIndex", 0) < known.get("ModifyIndex", 0):
+                    continue
+                changed = changed or known is None or known.get("ModifyIndex") != alloc.get("ModifyIndex")
+                self.allocs[alloc["ID"]] = alloc
+            self.cond.notify_all()
+        return changed
+
+    def schedule_poll(self, subscribed, changed):
+        # while the stream is down polls back off exponentially (with jitter) as long as nothing changes
+        if subscribed:
+            self.next_poll = self.last_poll + EVENT_STREAM_RESYNC
+            return
+        self.poll_interval = POLL_INTERVAL if changed else min(self.poll_interval * 2, max(POLL_INTERVAL, POLL_MAX_INTERVAL))
+        self.next_poll = self.last_poll + random.uniform(self.poll_interval / 2, self.poll_interval)
+
+    def latest_alloc(self):
+        with self.cond:
+            if not self.allocs:
+                return None
+            return max(self.allocs.values(), key=lambda alloc: alloc.get("CreateTime", 0))
+
+    def wait(self, timeout):
+        with self.cond:
+            self.cond.wait(timeout)
+
+
+class EventSubscription(threading.Thread):
+    """A single /v1/event/stream connection for a namespace, fanning Allocation/Job events out to JobWatches."""
+
+    def __init__(self, hub, key, namespace, token, region=None):
+        super().__init__(name=f"event-stream-{namespace}" + (f"-{region}" if region else ""), daemon=True)
+        self.hub = hub
+        self.key = key
+        self.namespace = namespace
+        self.token = token
+        self.region = region
+        self.watches = {}
+        self.connected = False
+        self.index = 0
+        self.idle_since = None
+        self.failures = 0
+
+    def dispatch(self, event):
+        payload = event.get("Payload") or {}
+        if event.get("Topic") == "Allocation" and "Allocation" in payload:
+            job_id = payload["Allocation"].get("JobID")
+            for watch in self.hub.watches_for(self, job_id):
+                watch.update_alloc(payload["Allocation"])
+        elif event.get("Topic") == "Job" and "Job" in payload:
+            for watch in self.hub.watches_for(self, payload["Job"].get("ID")):
+                watch.update_job(payload["Job"])
+
+    def run(self):
+        url = f"{NOMAD_ADDR}/v1/event/stream"
+        while not self.hub.should_close(self):
+            params = {"topic": ["Allocation", "Job"], "namespace": self.namespace}
+            if self.region:
+                params["region"] = self.region
+            if self.index:
+                params["index"] = self.index
+            try:
+                # Nomad sends a heartbeat every 10s, so a quiet read for much longer means the stream is dead
+                with nomad.get(
+                    url,
+                    headers={"X-Nomad-Token": self.token},
+                    params=params,
+                    stream=True,
+                    timeout=(TIMEOUT, 60),
+                    op="event_stream",
+                    priority=PRIORITY_BACKGROUND,
+                ) as resp:
+                    resp.raise_for_status()
+                    self.connected = True
+                    self.failures = 0
+                    # anything that happened before the stream was up is only visible through a re-read
+                    self.hub.mark_stale(self)
+                    logger.info(f"Event stream subscribed namespace:{self.namespace}")
+                    for line in resp.iter_lines():
+                        if self.hub.should_close(self):
+                            break
+                        if not line:
+                            continue
+                        frame = json.loads(line)
+                        for event in frame.get("Events") or []:
+                            self.dispatch(event)
+                        self.index = frame.get("Index", self.index)
+            except Exception as e:
+                self.failures += 1
+                upstream_retries.labels("event_stream").inc()
+                logger.warning(f"Event stream namespace:{self.namespace} failed ({self.failures}): {e}")
+            finally:
+                self.connected = False
+            if not self.hub.should_close(self):
+                time.sleep(backoff_delay(self.failures, cap=30) if self.failures else 1)
+        logger.info(f"Event stream closed namespace:{self.namespace}")
+
+
+class EventStreamHub:
+    """Process wide registry of event stream subscriptions and the job watches waiting on them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def subscribe(self, token, namespace, job_id, cond=None):
+        token = EVENT_STREAM_TOKEN or token
+        region = nomad_region.get()
+        key = (namespace, token, region)
+        watch = JobWatch(job_id, cond)
+        with self.lock:
+            sub = self.subscriptions.get(key)
+            if sub is None or not sub.is_alive():
+                sub = EventSubscription(self, key, namespace, token, region)
+                self.subscriptions[key] = sub
+                sub.start()
+            sub.watches.setdefault(job_id, set()).add(watch)
+            sub.idle_since = None
+        watch.subscription = sub
+        return watch
+
+    def unsubscribe(self, watch):
+        sub = watch.subscription
+        with self.lock:
+            watches = sub.watches.get(watch.job_id, set())
+            watches.discard(watch)
+            if not watches:
+                sub.watches.pop(watch.job_id, None)
+            if not sub.watches:
+                sub.idle_since = time.time()
+
+    def watches_for(self, sub, job_id):
+        with self.lock:
+            return list(sub.watches.get(job_id, ()))
+
+    def mark_stale(self, sub):
+        with self.lock:
+            watches = [watch for job_watches in sub.watches.values() for watch in job_watches]
+        now = time.time()
+        for watch in watches:
+            watch.stale_since = now
+            watch.stale = True
+
+    def should_close(self, sub):
+        with self.lock:
+            if sub.idle_since is None or time.time() - sub.idle_since < EVENT_STREAM_LINGER:
+                return False
+            if self.subscriptions.get(sub.key) is sub:
+                del self.subscriptions[sub.key]
+            return True
+
+
+event_hub = EventStreamHub()
+
+
+@contextmanager
+def job_watch(token, namespace, job_id, cond=None):
+    # a JobWatch fed by the shared event stream (or a bare one when the stream is disabled)
+    watch = event_hub.subscribe(token, namespace, job_id, cond) if EVENT_STREAM_ENABLED else JobWatch(job_id, cond)
+    try:
+        yield watch
+    finally:
+        if watch.subscription is not None:
+            event_hub.unsubscribe(watch)
+
+
+def wait_for_jobs(watches, poll, done, timeout, cancelled=lambda: False):
+    """Block until done(watch) holds for every watch, the timeout passes or cancelled() is set.
+
+    Updates come from the shared event stream; poll(watch, fresh_since) (returning the job's allocation list) is only
+    used to seed a watch, after the stream reconnected, every EVENT_STREAM_RESYNC seconds as a safety net,
+    and while the stream is unavailable or disabled (every POLL_INTERVAL, backing off to POLL_MAX_INTERVAL as
+    long as nothing changes). Polls after the first are background calls. The watches must share one condition.
+    """
+    deadline = time.time() + timeout
+    pending = list(watches)
+    while True:
+        for watch in pending:
+            subscribed = watch.subscription is not None and watch.subscription.connected
+            stale = watch.stale
+            stale_since = watch.stale_since
+            if subscribed and watch.next_poll > watch.last_poll + EVENT_STREAM_RESYNC:
+                # the stream came back while polls were backed off
+                watch.next_poll = watch.last_poll + EVENT_STREAM_RESYNC
+            if stale or time.time() >= watch.next_poll:
+                seeding = not watch.last_poll
+                watch.stale = False
+                watch.last_poll = time.time()
+                # a stale watch may have missed events, it needs a list read started after it went stale rather than a cached one
+                with ExitStack() as stack:
+                    if not seeding:
+                        stack.enter_context(background_calls())
+                    changed = watch.refresh(poll(watch, stale_since if stale else None))
+                watch.schedule_poll(subscribed, changed)
+        pending = [watch for watch in pending if not done(watch)]
+        if not pending or cancelled():
+            return
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        # wake up at least every second for cancel requests
+        with traced_phase("wait"):
+            pending[0].wait(min(remaining, 1.0))
+
+
+def wait_for_job(watch, poll, done, timeout, cancelled=lambda: False):
+    # wait_for_jobs() for a single watch, poll(fresh_since) returns its allocation list
+    wait_for_jobs([watch], lambda _, fresh_since: poll(fresh_since), done, timeout, cancelled)
+
+
+def job_placed(watch):
+    alloc = watch.latest_alloc()
+    return alloc is not None and bool(alloc.get("TaskStates"))
+
+
+def job_finished(watch):
+    alloc = watch.latest_alloc()
+    return alloc is not None and alloc.get("ClientStatus", "").lower() not in ("pending", "running")
+
+
+def trim_log_tail(data, nbytes):
+    # a tail read starts at an arbitrary byte, drop the partial first line (or at least a split UTF-8 sequence)
+    if len(data) >= nbytes:
+        newline = data.find(b"\n")
+        if 0 <= newline < len(data) - 1:
+            data = data[newline + 1 :]
+        else:
+            data = data.lstrip(bytes(range(0x80, 0xC0)))
+    return data.decode("utf-8", errors="replace")
+
+
+class NodeAddressCache:
+    """HTTP addresses of client nodes, looked up through /v1/node/<id> (needs node:read) and kept CLIENT_ADDR_TTL seconds.
+
+    None, meaning go through NOMAD_ADDR, is kept just as long for nodes that could not be looked up or reached.
+    """
+
+    def __init__(self, ttl=CLIENT_ADDR_TTL):
+        self.ttl = ttl
+        self.entries = {}  # (node_id, region) -> (expires, address)
+        self.lock = threading.Lock()
+
+    def _set(self, key, address):
+        now = time.time()
+        with self.lock:
+            if len(self.entries) > 10000:
+                self.entries = {k: v for k, v in self.entries.items() if v[0] > now}
+            self.entries[key] = (now + self.ttl, address)
+
+    def get(self, token, node_id):
+        key = (node_id, nomad_region.get())
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        address = None
+        try:
+            resp = nomad.get(f"{NOMAD_ADDR}/v1/node/{node_id}", headers={"X-Nomad-Token": token}, op="node")
+            resp.raise_for_status()
+            node = resp.json()
+            if node.get("HTTPAddr"):
+                address = f"{'https' if node.get('TLSEnabled') else 'http'}://{node['HTTPAddr']}"
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.debug(f"Address of node {node_id} not available, using {NOMAD_ADDR}: {e}")
+        self._set(key, address)
+        return address
+
+    def unreachable(self, node_id):
+        self._set((node_id, nomad_region.get()), None)
+
+
+node_addresses = NodeAddressCache()
+
+
+def never_sent(e):
+    # connect phase failures (refused, unresolvable, connect timeout, open breaker): the node cannot have seen the call.
+    # A dropped/reset connection after sending (ProtocolError) is not one of them, the node may have acted on it already
+    if isinstance(e, (CircuitOpenError, requests.exceptions.ConnectTimeout)):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def client_request(method, path, node_id, headers, **kwargs):
+    # client scoped call (/v1/client/...): straight to the allocation's node with CLIENT_DIRECT, through NOMAD_ADDR otherwise
+    address = node_addresses.get(headers["X-Nomad-Token"], node_id) if CLIENT_DIRECT and node_id else None
+    if address:
+        try:
+            return nomad.request(method, address + path, headers=headers, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            if not never_sent(e):
+                raise
+            # nothing reached the node, the servers forward it instead
+            logger.warning(f"Node {node_id} not reachable at {address}, going through {NOMAD_ADDR}: {e}")
+            node_addresses.unreachable(node_id)
+            client_fallbacks.labels(kwargs.get("op", "other")).inc()
+    return nomad.request(method, NOMAD_ADDR + path, headers=headers, **kwargs)
+
+
+def fetch_log_tail(headers, namespace, alloc_id, task_name, log_type, nbytes, node_id=None):
+    # only the last nbytes, as plain bytes (no base64 JSON framing)
+    path = f"/v1/client/fs/logs/{alloc_id}?namespace={namespace}&task={task_name}&type={log_type}&origin=end&offset={nbytes}&plain=true"
+    resp = client_request("GET", path, node_id, headers, op="log_tail")
+    if resp.status_code != 200:
+        logger.debug(f"Log tail {log_type} status_code:{resp.status_code} {resp.text[:200]}")
+        return ""
+    return trim_log_tail(resp.content[-nbytes:], nbytes)
+
+
+def fetch_log_tails(headers, namespace, alloc_id, task_name, nbytes=LOG_TAIL_BYTES, node_id=None):
+    # stdout and stderr tails, fetched concurrently; a failing fetch only costs its own log
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="logs") as pool:
+        futures = {
+            log_type: pool.submit(traced(fetch_log_tail), headers, namespace, alloc_id, task_name, log_type, nbytes, node_id)
+            for log_type in ("stdout", "stderr")
+        }
+    logs = {}
+    for log_type, future in futures.items():
+        try:
+            logs[log_type] = future.result()
+        except Exception as e:
+            logger.debug(f"Failed to fetch {log_type} for failed job: {e}")
+            logs[log_type] = ""
+    return logs
+
+
+def close_stream(resp):
+    # shut the socket down as well, a plain close() does not wake up a thread blocked reading it
+    sock = getattr(getattr(resp.raw, "connection", None), "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    resp.close()
+
+
+def follow_log(path, node_id, headers, log_type, lines, stop, opened):
+    """Reader thread for one follow=true log stream, pushing (log_type, line) into the bounded lines queue.
+
+    A full queue blocks the reader, so it stops reading from Nomad until the client caught up. Ends with a
+    (log_type, None) marker once Nomad closes the stream or stop is set.
+    """
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                lines.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    try:
+        while not stop.is_set():
+            try:
+                resp = client_request("GET", path, node_id, headers, stream=True, timeout=(TIMEOUT, None), op="log_follow")
+            except requests.exceptions.RequestException as e:
+                logger.debug(f"Log stream {log_type} not available yet: {e}")
+                upstream_retries.labels("log_follow").inc()
+                stop.wait(1)
+                continue
+            opened.append(resp)
+            if resp.status_code != 200:
+                # the task may not have written its log files yet
+                logger.debug(f"Log stream {log_type} status_code:{resp.status_code} {resp.text[:200]}")
+                upstream_retries.labels("log_follow").inc()
+                resp.close()
+                stop.wait(1)
+                continue
+            buffer = b""
+            try:
+                for chunk in resp.iter_content(chunk_size=None):
+                    buffer += chunk
+                    *complete, buffer = buffer.split(b"\n")
+                    for line in complete:
+                        put((log_type, line.rstrip(b"\r").decode("utf-8", errors="replace")))
+                    if len(buffer) > LOG_STREAM_MAX_LINE:
+                        put((log_type, buffer.decode("utf-8", errors="replace")))
+                        buffer = b""
+            except requests.exceptions.RequestException as e:
+                if not stop.is_set():
+                    logger.debug(f"Log stream {log_type} interrupted: {e}")
+            if buffer:
+                put((log_type, buffer.decode("utf-8", errors="replace")))
+            return
+    finally:
+        put((log_type, None))
+
+
+def format_stream_line(fmt, event, line):
+    if fmt == "sse":
+        return f"event: {event}\ndata: {line}\n\n"
+    if event == "status":
+        return timestamped_message(line)
+    return f"[{event}] {line}\n"
+
+
+def stream_job_logs(
+    token, namespace, dispatched_job_id, alloc_id, task_name, headers, poll, finished, timeout, cancelled, fmt, on_finish, node_id=None
+):
+    """Generator merging the live stdout/stderr of a task, ending with a status line once the job finished.
+
+    Closing the generator (client disconnect) stops the readers and closes the upstream log streams.
+    on_finish(status, alloc) is called once the stream is over, whichever way it ended ("disconnected", alloc None, when the client left).
+    """
+    stop = threading.Event()
+    opened = []
+    lines = queue.Queue(maxsize=LOG_STREAM_QUEUE)
+    for log_type in ("stdout", "stderr"):
+        path = (
+            f"/v1/client/fs/logs/{alloc_id}?namespace={namespace}&task={task_name}"
+            f"&type={log_type}&follow=true&plain=true&origin=start&offset=0"
+        )
+        threading.Thread(
+            target=traced(follow_log), args=(path, node_id, headers, log_type, lines, stop, opened), name=f"logs-{log_type}", daemon=True
+        ).start()
+
+    deadline = time.time() + timeout
+    status = "disconnected"
+    alloc = None
+    try:
+        with job_watch(token, namespace, dispatched_job_id) as watch:
+            yield format_stream_line(fmt, "status", f"following {task_name} of {dispatched_job_id} (alloc {alloc_id})")
+            open_streams = 2
+            finished_at = None
+            outcome = None
+            last_check = 0
+            last_write = time.time()
+            while open_streams:
+                try:
+                    log_type, line = lines.get(timeout=1)
+                    if line is None:
+                        open_streams -= 1
+                    else:
+                        last_write = time.time()
+                        yield format_stream_line(fmt, log_type, line)
+                except queue.Empty:
+                    if fmt == "sse" and time.time() - last_write > 15:
+                        # SSE comment, keeps proxies from timing out and notices a gone client on quiet tasks
+                        last_write = time.time()
+                        yield ": keepalive\n\n"
+                if time.time() - last_check < 1:
+                    continue
+                last_check = time.time()
+                wait_for_job(watch, poll, finished, 0)
+                if cancelled():
+                    outcome = "cancelled"
+                    break
+                if time.time() > deadline:
+                    outcome = "timeout"
+                    break
+                if finished(watch):
+                    # Nomad closes the streams itself after the task died, only wait a bit for the tail end
+                    finished_at = finished_at or time.time()
+                    if time.time() - finished_at > LOG_STREAM_DRAIN:
+                        break
+
+            wait_for_job(watch, poll, finished, 0)
+            alloc = watch.latest_alloc()
+            status = outcome or (alloc or {}).get("ClientStatus") or "unknown"
+            alloc = alloc or {}
+            result = {
+                "status": outcome or ("failed" if alloc.get("ClientStatus") == "failed" else "completed"),
+                "client_status": alloc.get("ClientStatus"),
+                "dispatched_job_id": dispatched_job_id,
+            }
+            yield format_stream_line(fmt, "status", json.dumps(result))
+    finally:
+        on_finish(status, alloc)
+        stop.set()
+        for resp in opened:
+            close_stream(resp)
+
+
+def dispatch_key(headers, namespace, job, meta, idempotency_key=""):
+    # same token, region, namespace, job, meta (in any order) and caller key -> same dispatch
+    parts = [
+        token_digest(headers["X-Nomad-Token"]),
+        nomad_region.get() or "",
+        namespace,
+        job,
+        json.dumps(meta, sort_keys=True),
+        idempotency_key,
+    ]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def dispatch_job(headers, namespace, job, meta, idempotency_key=None):
+    # POSTs one dispatch, returns (DispatchedJobID, duplicate); idempotency_key=None skips deduplication
+    dispatch_url = f"{NOMAD_ADDR}/v1/job/{job}/dispatch?namespace={namespace}"
+    payload = {"meta": meta}
+    if idempotency_key is not None and DISPATCH_DEDUPE_TTL > 0:
+        key = dispatch_key(headers, namespace, job, meta, idempotency_key)
+        delay = 0.05
+        while True:
+            claimed, dispatched_job_id = registry.claim_dispatch(key)
+            if claimed or dispatched_job_id:
+                break
+            # an identical dispatch is in flight: wait for its result, or for it to fail/expire and claim it then
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        dispatch_dedupe.labels("hit" if dispatched_job_id else "miss").inc()
+        if dispatched_job_id:
+            logger.info(f"Duplicate dispatch of {job} in {namespace}, returning {dispatched_job_id}")
+            return dispatched_job_id, True
+        if idempotency_key:
+            # Nomad hands back the existing child for a known token until it is garbage collected, finished or not,
+            # so only an explicit caller key (one per intended run) goes upstream, never the derived meta-only key
+            payload["IdempotencyToken"] = key
+    logger.info(f"Dispatching job to: {dispatch_url}")
+    try:
+        response = nomad.post(dispatch_url, headers=headers, json=payload, op="dispatch")
+        response.raise_for_status()
+        dispatched_job_id = response.json()["DispatchedJobID"]
+    except BaseException:
+        if idempotency_key is not None and DISPATCH_DEDUPE_TTL > 0:
+            registry.release_dispatch(key)
+        raise
+    if idempotency_key is not None and DISPATCH_DEDUPE_TTL > 0:
+        registry.remember_dispatch(key, dispatched_job_id)
+    return dispatched_job_id, False
+
+
+def finished_job_result(headers, namespace, alloc, nomad_ui_job_url, log_bytes):
+    # (payload, http status) for a dispatched job that stopped: 418 with the log tails when it failed
+    final_status = alloc.get("ClientStatus", "")
+    if final_status.lower() == "failed":
+        # Collect the tail end of stdout/stderr from the allocation
+        task_name = list((alloc.get("TaskStates") or {"": None}).keys())[0]
+        logs = fetch_log_tails(headers, namespace, alloc["ID"], task_name, log_bytes, alloc.get("NodeID"))
+        return {"error": "Nomad Job Failed", "nomad_ui_job_url": nomad_ui_job_url, "stdout": logs["stdout"], "stderr": logs["stderr"]}, 418
+    return {"status": "completed", "client_status": final_status, "nomad_ui_job_url": nomad_ui_job_url}, 200
+
+
+def circuit_open_response(e):
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(int(e.retry_after + 0.999))}
+
+
+def job_ui_url(dispatched_job_id, namespace):
+    url = f"{NOMAD_ADDR}/ui/jobs/{urllib.parse.quote(dispatched_job_id, safe='')}@{namespace}"
+    return f"{url}?region={nomad_region.get()}" if nomad_region.get() else url
+
+
+def list_regions(token):
+    resp = nomad.get(f"{NOMAD_ADDR}/v1/regions", headers={"X-Nomad-Token": token}, op="regions")
+    resp.raise_for_status()
+    return resp.json()
+
+
+def fan_out_regions(token, regions, view, args, totals=()):
+    """Run view(*args) once per region (regions is "a,b" or "*" for every federated region) and merge the results.
+
+    Regions run concurrently, each with its own fan-out/concurrency budget, as if juggler had been called
+    with ?region=. totals are numeric result fields summed over the regions.
+    """
+    try:
+        names = list_regions(token) if regions.strip() == "*" else [region.strip() for region in regions.split(",") if region.strip()]
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except requests.exceptions.RequestException as e:
+        return jsonify({"error": f"Failed to list regions: {e}"}), 500
+    if not names:
+        return jsonify({"error": "No regions to run in"}), 400
+
+    def run_region(region):
+        nomad_region.set(region)
+        started = time.time()
+        try:
+            response = app.make_response(view(*args))
+            result, code = response.get_json(silent=True), response.status_code
+        except CircuitOpenError as e:
+            result, code = {"error": str(e)}, 503
+        except Exception as e:
+            result, code = {"error": str(e)}, 500
+        return region, {"status_code": code, "seconds": round(time.time() - started, 3), **(result or {})}
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="region") as pool:
+        results = dict(pool.map(traced(run_region), names))
+
+    failed = [region for region, result in results.items() if result["status_code"] >= 400]
+    merged = {"regions": results, "failed_regions": failed, "seconds": round(time.time() - started, 3)}
+    for total in totals:
+        merged[total] = sum(result.get(total, 0) for result in results.values())
+    logger.info({k: v for k, v in merged.items() if k != "regions"})
+    return jsonify(merged), 418 if failed else 200
+
+
+def job_state(alloc):
+    # "pending" until an allocation exists, then its client status
+    return alloc.get("ClientStatus", "pending") if alloc else "pending"
+
+
+def nomad_time(value):
+    # RFC3339 (nanoseconds) task timestamp -> epoch seconds, None for unset/zero times
+    try:
+        seconds = datetime.fromisoformat(value).timestamp() if value else None
+    except ValueError:
+        return None
+    return seconds if seconds and seconds > 0 else None
+
+
+def observe_job_lifecycle(job, namespace, dispatched_at, alloc, outcome):
+    """Records the timings Nomad keeps on the allocation once a tail/batch wait is over.
+
+    Placement is measured from juggler's dispatch call (dispatched_at, None for deduplicated dispatches),
+    start and run time from the allocation's CreateTime and the task StartedAt/FinishedAt.
+    """
+    job_outcomes.labels(job, namespace, outcome).inc()
+    if not alloc:
+        return
+    placed = alloc.get("CreateTime", 0) / 1e9 or None
+    states = (alloc.get("TaskStates") or {}).values()
+    started = [nomad_time(state.get("StartedAt")) for state in states]
+    finished = [nomad_time(state.get("FinishedAt")) for state in states]
+    started = min(filter(None, started), default=None)
+    finished = max(finished, default=None) if all(finished) else None
+    if placed and dispatched_at:
+        job_placement_seconds.labels(job, namespace).observe(max(placed - dispatched_at, 0))
+    if placed and started:
+        job_start_seconds.labels(job, namespace).observe(max(started - placed, 0))
+    if started and finished:
+        job_run_seconds.labels(job, namespace).observe(max(finished - started, 0))
+
+
+@app.before_request
+def start_trace():
+    current_trace.set(RequestTrace())
+    nomad_region.set(request.args.get("region") or None)
+
+
+@app.after_request
+def finish_trace(response):
+    trace = current_trace.get()
+    if trace is None or not request.path.startswith("/api/"):
+        return response
+    endpoint = request.endpoint
+    # view args without the token, never logged
+    args = {k: v for k, v in (request.view_args or {}).items() if k != "token"}
+
+    def report():
+        # runs once the response is fully sent, so streamed tails are measured until their last line
+        elapsed = time.time() - trace.start
+        request_poll_iterations.labels(endpoint).observe(trace.polls)
+        if SLOW_REQUEST_SECONDS and elapsed > SLOW_REQUEST_SECONDS:
+            logger.warning(
+                {
+                    "slow_request": endpoint,
+                    **args,
+                    "status_code": response.status_code,
+                    "seconds": round(elapsed, 3),
+                    "polls": trace.polls,
+                    "phases": trace.summary(),
+                }
+            )
+
+    response.call_on_close(report)
+    return response
+
+
+@app.before_request
+def admit_request():
+    if not request.path.startswith("/api/") or request.endpoint in ("cancel_job_stream", "list_tails", None):
+        return None
+    token_hash, namespace = token_digest(request.view_args["token"]), request.view_args["namespace"]
+    reason = admission.admit(token_hash, namespace)
+    if reason:
+        admission_rejections.labels(reason).inc()
+        return jsonify({"error": AdmissionControl.ERRORS[reason]}), 429, {"Retry-After": str(ADMISSION_RETRY_AFTER)}
+    g.admitted = (token_hash, namespace)
+    return None
+
+
+@app.after_request
+def release_admission(response):
+    # streamed responses (tails, ndjson) hold their slot until the last byte is sent
+    admitted = g.pop("admitted", None)
+    if admitted:
+        response.call_on_close(lambda: admission.release(*admitted))
+    return response
+
+
+@app.teardown_request
+def release_admission_on_error(exc):
+    # after_request is skipped when a view raised
+    admitted = g.pop("admitted", None)
+    if admitted:
+        admission.release(*admitted)
+
+
 @app.route("/api/<token>/<namespace>/restart/<job>", methods=["GET"])
 def restart_allocations(token, namespace, job):
+    if request.args.get("regions"):
+        if request.args.get("format") == "ndjson":
+            return jsonify({"error": "format=ndjson cannot be combined with regions"}), 400
+        return fan_out_regions(token, request.args["regions"], restart_job, (token, namespace, job), ("running_allocs", "total_restarted"))
+    return restart_job(token, namespace, job)
+
+
+def restart_job(token, namespace, job):
     try:
+        denied = require_capability(token, namespace, "alloc-lifecycle")
+        if denied:
+            return denied
         headers = {"X-Nomad-Token": token}
         meta_params = request.args.to_dict()
-        timeout = int(meta_params.pop("timeout", 1200))  # default to 1200 seconds
+        try:
+            timeout = int_param("timeout", meta_params.pop("timeout", None), 1200, 1, MAX_WAIT_TIMEOUT)  # default to 1200 seconds
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         wait = meta_params.get("wait", "false").lower() == "true"
         dry_run = meta_params.get("dry_run", "false").lower() == "true"
         verbose = meta_params.get("verbose", "false").lower() == "true"
         task_name = meta_params.get("task_name")  # optional filter
-
-        # Step 1: Get all allocations for the job
-        alloc_url = f"{NOMAD_ADDR}/v1/job/{job}/allocations?namespace={namespace}"
-        response = requests.get(alloc_url, headers=headers)
-        response.raise_for_status()
-        allocations = response.json()
-
-        # Step 2: Filter running allocations
+        # optional node selection, comma separated: node names/IDs, datacenters, node pools
+        nodes, datacenters, node_pools = (
+            [value for value in meta_params.get(key, "").split(",") if value] for key in ("node", "datacenter", "node_pool")
+        )
+        node_filter = {key: values for key, values in (("node", nodes), ("datacenter", datacenters), ("node_pool", node_pools)) if values}
+        output_format = meta_params.get("format", "json")  # json|ndjson
+        if output_format not in ("json", "ndjson"):
+            return jsonify({"error": f"Unsupported format: {output_format} (json|ndjson)"}), 400
+
+        # Step 1: Get the running allocations of the job, filtered by Nomad
+        alloc_url = f"{NOMAD_ADDR}/v1/job/{urllib.parse.quote(job, safe='')}/allocations?namespace={namespace}"
+        node_ids = list_node_ids(token, datacenters, node_pools) if datacenters or node_pools else None
+        # verbose lists the allocations skipped for task_name, those have to be fetched too
+        allocations, alloc_index = list_running_allocations(token, namespace, job, None if verbose else task_name, nodes)
+
+        # Step 2: Filter running allocations (again, Nomad may not have filtered)
         running_allocs = []
         for alloc in allocations:
             if alloc.get("ClientStatus") != "running":
                 continue
+            if nodes and alloc.get("NodeName") not in nodes and alloc.get("NodeID") not in nodes:
+                continue
+            if node_ids is not None and alloc.get("NodeID") not in node_ids:
+                continue
 
             task_states = alloc.get("TaskStates", {})
             running_tasks = [task for task, state in task_states.items() if state.get("State") == "running"]
 
             if running_tasks:
-                alloc["RunningTasks"] = running_tasks  # optional: store for verbose output
-                running_allocs.append(alloc)
+                # cached lists are shared between requests, annotate a copy
+                running_allocs.append(dict(alloc, RunningTasks=running_tasks))
 
         # Step 2.5: If task_name is provided, filter allocations that include that task
         skipped_allocations = []
@@ -136,24 +2332,138 @@ def restart_allocations(token, namespace, job):
                     )
             running_allocs = filtered_allocs
 
+        max_parallel = int(meta_params.get("max_parallel", RESTART_MAX_PARALLEL))
+        per_node_parallel = int(meta_params.get("per_node_parallel", RESTART_PER_NODE_PARALLEL))
+        batch_size = int(meta_params.get("batch_size", RESTART_BATCH_SIZE))
+        batch_pause = parse_duration(meta_params.get("batch_pause", RESTART_BATCH_PAUSE))
+
+        def restart_alloc(alloc):
+            restart_path = f"/v1/client/allocation/{alloc['ID']}/restart?namespace={namespace}"
+            restart_url = NOMAD_ADDR + restart_path
+            if dry_run:
+                logger.info(f"[DRY RUN] Would restart: {restart_url}")
+                return {"ok": True, "restart_url": restart_url}
+            started = time.time()
+            restart_resp = client_request("POST", restart_path, alloc.get("NodeID"), headers, op="restart")
+            if restart_resp.status_code == 200:
+                logger.debug(restart_url)
+            else:
+                logger.error(restart_url)
+            return {
+                "ok": restart_resp.status_code == 200,
+                "status_code": restart_resp.status_code,
+                "restart_url": restart_url,
+                "requested_at": started,
+                "elapsed": round(time.time() - started, 3),
+            }
+
+        def list_allocs(index, wait_seconds):
+            count_poll()
+            wait_resp = nomad.get(
+                alloc_url,
+                headers=headers,
+                params={"index": index, "wait": f"{int(wait_seconds)}s"},
+                timeout=wait_seconds * 1.1 + TIMEOUT,
+                op="job_allocations_blocking",
+                priority=PRIORITY_BACKGROUND,
+            )
+            wait_resp.raise_for_status()
+            allocations, index = wait_resp.json(), int(wait_resp.headers.get("X-Nomad-Index", 0))
+            alloc_cache.store(alloc_cache_key(token, namespace, job), allocations, index, len(wait_resp.content))
+            return allocations, index
+
+        if output_format == "ndjson":
+            # one line per allocation as it is restarted / becomes ready, then a summary; nothing is kept per alloc but its baseline
+            def progress():
+                restart_start = time.time()
+                baselines = {}
+                requested_at = {}
+                failed = []
+                summary = {"event": "summary", "running_allocs": len(running_allocs), "total_restarted": 0}
+                try:
+                    for alloc, result in iter_restarts(
+                        running_allocs, restart_alloc, max_parallel, per_node_parallel, batch_size, batch_pause
+                    ):
+                        line = {
+                            "event": "restart",
+                            "alloc_id": alloc["ID"],
+                            "node_name": alloc.get("NodeName"),
+                            "ok": result["ok"],
+                            "status_code": result.get("status_code"),
+                            "error": result.get("error"),
+                            "elapsed": result.get("elapsed"),
+                        }
+                        if verbose:
+                            line.update(
+                                node_id=alloc.get("NodeID"),
+                                task_names=list(alloc.get("TaskStates", {}).keys()),
+                                running_tasks=alloc.get("RunningTasks", []),
+                                restart_url=result.get("restart_url"),
+                                dry_run=dry_run,
+                            )
+                        if result["ok"]:
+                            summary["total_restarted"] += 1
+                            if not dry_run:
+                                baselines[alloc["ID"]] = task_restart_marks(alloc, [task_name] if task_name else alloc["RunningTasks"])
+                                requested_at[alloc["ID"]] = result["requested_at"]
+                        else:
+                            failed.append(alloc["ID"])
+                        yield json.dumps(line) + "\n"
+                    summary.update(failed_allocations=failed, restart_seconds=round(time.time() - restart_start, 3))
+                    if baselines:
+                        alloc_cache.invalidate(namespace, job)
+
+                    if wait and baselines:
+                        ready = gone = 0
+                        wait_start = time.time()
+                        with inflight_waits.labels("restart").track_inprogress():
+                            for event, alloc_id, _ in iter_restart_readiness(list_allocs, baselines, alloc_index, wait_start + timeout):
+                                ready += event == "ready"
+                                gone += event == "gone"
+                                yield json.dumps(
+                                    {"event": event, "alloc_id": alloc_id, "seconds": round(time.time() - requested_at[alloc_id], 3)}
+                                ) + "\n"
+                        summary["wait"] = {
+                            "ready": ready,
+                            "terminal_or_missing": gone,
+                            "not_ready": len(baselines) - ready - gone,
+                            "wait_seconds": round(time.time() - wait_start, 3),
+                            "timed_out": ready + gone < len(baselines),
+                        }
+                except Exception as e:
+                    summary["error"] = str(e)
+
+                summary.update(
+                    max_parallel=max_parallel,
+                    per_node_parallel=per_node_parallel,
+                    waited=wait,
+                    filtered_by_task_name=task_name if task_name else "none",
+                    filtered_by_node=node_filter or "none",
+                    dry_run=dry_run,
+                )
+                if verbose and task_name:
+                    summary["skipped_due_to_task_name_mismatch"] = skipped_allocations
+                logger.info(summary)
+                yield json.dumps(summary) + "\n"
+
+            return Response(progress(), mimetype="application/x-ndjson", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        # Step 3: Restart, bounded overall and per node
+        restart_start = time.time()
+        results = {}
+        for alloc, result in iter_restarts(running_allocs, restart_alloc, max_parallel, per_node_parallel, batch_size, batch_pause):
+            results[alloc["ID"]] = result
+
         restarted = []
+        failed = []
         verbose_details = []
-        restart_url = None
-
         for alloc in running_allocs:
             alloc_id = alloc["ID"]
-            restart_url = f"{NOMAD_ADDR}/v1/client/allocation/{alloc_id}/restart?namespace={namespace}"
-
-            if dry_run:
-                logger.info(f"[DRY RUN] Would restart: {restart_url}")
+            result = results[alloc_id]
+            if result["ok"]:
                 restarted.append(alloc_id)
             else:
-                restart_resp = requests.post(restart_url, headers=headers)
-                if restart_resp.status_code == 200:
-                    logger.debug(restart_url)
-                    restarted.append(alloc_id)
-                else:
-                    logger.error(restart_url)
+                failed.append(alloc_id)
 
             if verbose:
                 verbose_details.append(
@@ -163,35 +2473,59 @@ def restart_allocations(token, namespace, job):
                         "node_name": alloc.get("NodeName"),
                         "task_names": list(alloc.get("TaskStates", {}).keys()),
                         "running_tasks": alloc.get("RunningTasks", []),
-                        "restart_url": restart_url,
+                        "restart_url": result.get("restart_url"),
+                        "status_code": result.get("status_code"),
+                        "error": result.get("error"),
+                        "elapsed": result.get("elapsed"),
                         "dry_run": dry_run,
                     }
                 )
+        restart_elapsed = round(time.time() - restart_start, 3)
+        if restarted and not dry_run:
+            alloc_cache.invalidate(namespace, job)
 
-        # Step 3 (Optional): Wait for allocations to become running again
+        # Step 4 (Optional): Wait for the restarted allocations to come back, one blocking query on the job at a time
+        wait_details = None
         if wait and not dry_run:
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                all_ready = True
-                for alloc_id in restarted:
-                    status_url = f"{NOMAD_ADDR}/v1/allocation/{alloc_id}?namespace={namespace}"
-                    status_resp = requests.get(status_url, headers=headers)
-                    if status_resp.status_code != 200 or status_resp.json().get("ClientStatus") != "running":
-                        all_ready = False
-                        break
-                if all_ready:
-                    break
-                time.sleep(5)
+            baselines = {
+                alloc["ID"]: task_restart_marks(alloc, [task_name] if task_name else alloc["RunningTasks"])
+                for alloc in running_allocs
+                if alloc["ID"] in restarted
+            }
+            ready = {}
+            gone = []
+            wait_start = time.time()
+            with inflight_waits.labels("restart").track_inprogress():
+                for event, alloc_id, _ in iter_restart_readiness(list_allocs, baselines, alloc_index, wait_start + timeout):
+                    if event == "ready":
+                        ready[alloc_id] = round(time.time() - results[alloc_id]["requested_at"], 3)
+                    else:
+                        gone.append(alloc_id)
+            wait_details = {
+                "ready": ready,
+                "not_ready": [alloc_id for alloc_id in restarted if alloc_id not in ready],
+                "terminal_or_missing": gone,
+                "wait_seconds": round(time.time() - wait_start, 3),
+                "timed_out": len(ready) + len(gone) < len(restarted),
+            }
 
         returnlog = {
             "running_allocs": len(running_allocs),
             "restarted_allocations": restarted,
             "total_restarted": len(restarted),
+            "failed_allocations": failed,
+            "restart_seconds": restart_elapsed,
+            "max_parallel": max_parallel,
+            "per_node_parallel": per_node_parallel,
             "waited": wait,
             "filtered_by_task_name": task_name if task_name else "none",
+            "filtered_by_node": node_filter or "none",
             "dry_run": dry_run,
         }
 
+        if wait_details is not None:
+            returnlog["wait"] = wait_details
+
         if verbose:
             returnlog["details"] = verbose_details
             if task_name:
@@ -200,47 +2534,72 @@ def restart_allocations(token, namespace, job):
         logger.info(returnlog)
         return jsonify(returnlog)
 
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except requests.exceptions.HTTPError as e:
+        return jsonify({"error": f"HTTP error: {e}"}), e.response.status_code
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/<token>/<namespace>/dispatch/<job>", methods=["GET"])
 def dispatch_wait_and_tail(token, namespace, job):
+    if request.args.get("regions"):
+        if request.args.get("stream"):
+            return jsonify({"error": "stream cannot be combined with regions, use tail"}), 400
+        return fan_out_regions(token, request.args["regions"], dispatch_and_tail, (token, namespace, job))
+    return dispatch_and_tail(token, namespace, job)
+
+
+def dispatch_and_tail(token, namespace, job):
     try:
+        denied = require_capability(token, namespace, "dispatch-job")
+        if denied:
+            return denied
         headers = {"X-Nomad-Token": token}
         meta_params = request.args.to_dict()
-        timeout = int(meta_params.pop("timeout", 1200))  # default to 1200 seconds
+        try:
+            timeout = int_param("timeout", meta_params.pop("timeout", None), 1200, 1, MAX_WAIT_TIMEOUT)  # default to 1200 seconds
+            # log tail returned on failure
+            log_bytes = int_param("log_bytes", meta_params.get("log_bytes"), LOG_TAIL_BYTES, 1, MAX_LOG_BYTES)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         dry_run = meta_params.get("dry_run", "false").lower() == "true"
         verbose = meta_params.get("verbose", "false").lower() == "true"
+        stream = meta_params.get("stream")  # text|sse, stream the logs live while tailing
+        if stream and stream not in ("text", "sse"):
+            return jsonify({"error": f"Unsupported stream format: {stream} (text|sse)"}), 400
+        # retried calls (eg. after a client timeout) get the job of the first call, dedupe=false always dispatches
+        idempotency_key = meta_params.get("idempotency_key", "") if meta_params.get("dedupe", "true").lower() == "true" else None
         task_id = f"{token}:{namespace}:{job}"
-        cancel_flags[task_id] = False
 
         # Prepare dispatch payload
-        data = {"meta": {k: str(v) for k, v in meta_params.items() if k not in ["tail", "dry_run", "verbose"]}}
+        data = {"meta": {k: str(v) for k, v in meta_params.items() if k not in JUGGLER_PARAMS}}
         dispatch_url = f"{NOMAD_ADDR}/v1/job/{job}/dispatch?namespace={namespace}"
 
         if dry_run:
             logger.info(f"[DRY RUN] Would dispatch job to: {dispatch_url}")
             return jsonify({"status": "dry_run", "dispatch_url": dispatch_url, "meta": data["meta"]}), 200
 
-        logger.info(f"Dispatching job to: {dispatch_url}")
-        response = requests.post(dispatch_url, headers=headers, json=data, timeout=TIMEOUT)
-        response.raise_for_status()
-
-        if response.status_code != 200:
-            return Response(f"Dispatch failed: {response.text}", status=response.status_code)
-
-        dispatched_job_id = response.json()["DispatchedJobID"]
-        job_id = urllib.parse.quote(dispatched_job_id, safe="")
-        alloc_url = f"{NOMAD_ADDR}/v1/job/{job_id}/allocations?namespace={namespace}"
-        nomad_ui_job_url = f"{NOMAD_ADDR}/ui/jobs/{job_id}@{namespace}"
+        dispatched_at = time.time()
+        dispatched_job_id, duplicate = dispatch_job(headers, namespace, job, data["meta"], idempotency_key)
+        nomad_ui_job_url = job_ui_url(dispatched_job_id, namespace)
 
-        if "tail" not in meta_params:
+        if "tail" not in meta_params and not stream:
             result = {
                 "status": "dispatched",
                 "dispatched_job_id": dispatched_job_id,
+                "duplicate": duplicate,
                 "dispatch_url": dispatch_url,
                 "nomad_ui_job_url": nomad_ui_job_url,
+                # long-poll this instead of holding the connection open with tail
+                "status_url": url_for(
+                    "dispatched_job_status",
+                    token=token,
+                    namespace=namespace,
+                    dispatched_id=dispatched_job_id,
+                    **({"region": nomad_region.get()} if nomad_region.get() else {}),
+                ),
             }
             if verbose:
                 result["meta"] = data["meta"]
@@ -248,102 +2607,262 @@ def dispatch_wait_and_tail(token, namespace, job):
 
         # Blocking tail: wait for allocation + job completion, then return final status.
         # This blocks the request until the job finishes or timeout is reached.
-        # Wait for allocation
-        alloc_id = None
-        task_name = None
-        for _ in range(10):
-            alloc_resp = requests.get(alloc_url, headers=headers, timeout=TIMEOUT)
-            alloc_resp.raise_for_status()
-            if alloc_resp.status_code == 200 and alloc_resp.json():
-                alloc = alloc_resp.json()[0]
+        # Status changes arrive through the shared event stream, polling is only a fallback.
+        def poll_allocations(fresh_since=None):
+            return list_job_allocations(token, namespace, dispatched_job_id, fresh_since)[0]
+
+        tail_id = registry.register(token, namespace, job, dispatched_job_id, timeout)
+        tail_status = "error"
+        tail_alloc = None
+        streaming = False
+        tail_kind = "stream" if stream else "tail"
+        inflight_waits.labels(tail_kind).inc()
+
+        def finish_tail(status, alloc=None):
+            registry.finish(tail_id, status)
+            inflight_waits.labels(tail_kind).dec()
+            if status not in ("disconnected", "error"):
+                observe_job_lifecycle(job, namespace, None if duplicate else dispatched_at, alloc, status)
+
+        try:
+            with job_watch(token, namespace, dispatched_job_id) as watch:
+                # Wait for allocation
+                wait_for_job(watch, poll_allocations, job_placed, 10 * POLL_INTERVAL)
+                alloc = watch.latest_alloc()
+                if not job_placed(watch):
+                    tail_status = "no_allocation"
+                    tail_alloc = alloc
+                    return jsonify({"error": "Failed to get allocation"}), 504
                 alloc_id = alloc["ID"]
-                if "TaskStates" in alloc and alloc["TaskStates"]:
-                    task_name = list(alloc["TaskStates"].keys())[0]
-                    break
-            time.sleep(POLL_INTERVAL)
+                task_name = list(alloc["TaskStates"].keys())[0]
+                registry.set_status(tail_id, "running")
+
+                if stream:
+                    logs = stream_job_logs(
+                        token,
+                        namespace,
+                        dispatched_job_id,
+                        alloc_id,
+                        task_name,
+                        headers,
+                        poll_allocations,
+                        job_finished,
+                        timeout,
+                        lambda: registry.cancel_requested(tail_id),
+                        stream,
+                        finish_tail,
+                        alloc.get("NodeID"),
+                    )
+                    streaming = True
+                    mimetype = "text/event-stream" if stream == "sse" else "text/plain"
+                    return Response(logs, mimetype=mimetype, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        if not task_name:
-            return jsonify({"error": "Failed to get allocation"}), 504
+                wait_for_job(watch, poll_allocations, job_finished, timeout, cancelled=lambda: registry.cancel_requested(tail_id))
+                alloc = tail_alloc = watch.latest_alloc()
+                if registry.cancel_requested(tail_id):
+                    tail_status = "cancelled"
+                    return jsonify({"status": "cancelled", "task_id": task_id}), 200
 
-        status_url = f"{NOMAD_ADDR}/v1/job/{job_id}/allocations?namespace={namespace}"
-        start_time = time.time()
-        final_status = None
+                final_status = alloc.get("ClientStatus", "")
 
-        while time.time() - start_time < timeout:
-            if cancel_flags.get(task_id):
-                cancel_flags.pop(task_id, None)
-                return jsonify({"status": "cancelled", "task_id": task_id}), 200
+            if not final_status:
+                return jsonify({"error": "No status available"}), 504
+            tail_status = final_status
 
-            status_resp = requests.get(status_url, headers=headers, timeout=TIMEOUT)
-            status_resp.raise_for_status()
-            if status_resp.status_code == 200 and status_resp.json():
-                final_status = status_resp.json()[0].get("ClientStatus", "")
-                if final_status.lower() not in ("pending", "running"):
-                    break
+            result, code = finished_job_result(headers, namespace, alloc, nomad_ui_job_url, log_bytes)
+            if verbose and code == 200:
+                result["meta"] = data["meta"]
+            return jsonify(result), code
+        finally:
+            if not streaming:
+                finish_tail(tail_status, tail_alloc)
 
-            time.sleep(POLL_INTERVAL)
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except requests.exceptions.ConnectionError as e:
+        return jsonify({"error": f"Connection error: {e}"}), 503
+    except requests.exceptions.Timeout as e:
+        return jsonify({"error": f"Timeout error (TIMEOUT:{TIMEOUT}): {e}"}), 504
+    except requests.exceptions.HTTPError as e:
+        return jsonify({"error": f"HTTP error: {e}"}), e.response.status_code
+    except requests.exceptions.TooManyRedirects as e:
+        return jsonify({"error": f"Too many redirects: {e}"}), 310
+    except requests.exceptions.RequestException as e:
+        return jsonify({"error": f"Unexpected error: {e}"}), 500
 
-        if not final_status:
-            return jsonify({"error": "No status available"}), 504
 
-        if final_status.lower() == "failed":
-            # Try to collect last available stdout/stderr from the allocation
-            stdout_log = ""
-            stderr_log = ""
-            try:
-                stdout_url = f"{NOMAD_ADDR}/v1/client/fs/logs/{alloc_id}?namespace={namespace}&task={task_name}&type=stdout&offset=0"
-                stderr_url = f"{NOMAD_ADDR}/v1/client/fs/logs/{alloc_id}?namespace={namespace}&task={task_name}&type=stderr&offset=0"
-
-                so = requests.get(stdout_url, headers=headers, timeout=TIMEOUT)
-                if so.status_code == 200 and so.text.strip():
-                    so_j = so.json()
-                    if so_j.get("Data"):
-                        stdout_log = base64.b64decode(so_j["Data"]).decode("utf-8", errors="replace")
-
-                se = requests.get(stderr_url, headers=headers, timeout=TIMEOUT)
-                if se.status_code == 200 and se.text.strip():
-                    se_j = se.json()
-                    if se_j.get("Data"):
-                        stderr_log = base64.b64decode(se_j["Data"]).decode("utf-8", errors="replace")
-            except Exception as e:
-                logger.debug(f"Failed to fetch logs for failed job: {e}")
+@app.route("/api/<token>/<namespace>/dispatch-batch/<job>", methods=["GET", "POST"])
+def dispatch_batch(token, namespace, job):
+    try:
+        denied = require_capability(token, namespace, "dispatch-job")
+        if denied:
+            return denied
+        headers = {"X-Nomad-Token": token}
+        params = request.args
+        try:
+            timeout = int_param("timeout", params.get("timeout"), 1200, 1, MAX_WAIT_TIMEOUT)
+            max_parallel = int_param("max_parallel", params.get("max_parallel"), BATCH_DISPATCH_PARALLEL, 1, BATCH_DISPATCH_MAX_ITEMS)
+            log_bytes = int_param("log_bytes", params.get("log_bytes"), LOG_TAIL_BYTES, 1, MAX_LOG_BYTES)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        wait = params.get("wait", "false").lower() == "true"
+        dry_run = params.get("dry_run", "false").lower() == "true"
+        idempotency_key = params.get("idempotency_key", "") if params.get("dedupe", "true").lower() == "true" else None
+
+        if request.method == "POST":
+            # [{"DAY": "1970-01-01"}, ...] or {"meta": [...]}
+            body = request.get_json(silent=True)
+            meta_sets = body.get("meta") if isinstance(body, dict) else body
+            if not isinstance(meta_sets, list) or not all(isinstance(meta, dict) for meta in meta_sets):
+                return jsonify({"error": 'Expected a JSON list of meta objects (or {"meta": [...]})'}), 400
+        else:
+            # repeated query values multiply: ?DAY=1&DAY=2&SCRIPT=a&SCRIPT=b -> 4 dispatches
+            keys = [key for key in params if key not in BATCH_PARAMS]
+            meta_sets = [dict(zip(keys, values)) for values in itertools.product(*(params.getlist(key) for key in keys))]
+
+        meta_sets = [{k: str(v) for k, v in meta.items()} for meta in meta_sets]
+        if not meta_sets:
+            return jsonify({"error": "Nothing to dispatch"}), 400
+        if len(meta_sets) > BATCH_DISPATCH_MAX_ITEMS:
+            return jsonify({"error": f"{len(meta_sets)} dispatches exceed BATCH_DISPATCH_MAX_ITEMS:{BATCH_DISPATCH_MAX_ITEMS}"}), 400
 
-            # Truncate logs to a reasonable size
-            maxlen = 10000
-            if len(stdout_log) > maxlen:
-                stdout_log = stdout_log[-maxlen:]
-            if len(stderr_log) > maxlen:
-                stderr_log = stderr_log[-maxlen:]
+        if dry_run:
+            logger.info(f"[DRY RUN] Would dispatch {len(meta_sets)} x {job} in namespace {namespace}")
+            return jsonify({"status": "dry_run", "total": len(meta_sets), "meta": meta_sets}), 200
 
-            return (
-                jsonify(
-                    {
-                        "error": "Nomad Job Failed",
-                        "nomad_ui_job_url": nomad_ui_job_url,
-                        "stdout": stdout_log,
-                        "stderr": stderr_log,
-                    }
-                ),
-                418,
-            )
+        batch_start = time.time()
+        items = [{"meta": meta} for meta in meta_sets]
+
+        def dispatch_item(item):
+            started = item["dispatched_at"] = time.time()
+            try:
+                item["dispatched_job_id"], item["duplicate"] = dispatch_job(headers, namespace, job, item["meta"], idempotency_key)
+                item["status"] = "dispatched"
+            except requests.exceptions.RequestException as e:
+                item["status"] = "error"
+                item["error"] = str(e)
+            item["dispatch_seconds"] = round(time.time() - started, 3)
+
+        with ThreadPoolExecutor(max_workers=min(max_parallel, len(items)), thread_name_prefix="dispatch") as pool:
+            list(pool.map(traced(dispatch_item), items))
+
+        dispatched = [item for item in items if item["status"] == "dispatched"]
+        for item in dispatched:
+            item["nomad_ui_job_url"] = job_ui_url(item["dispatched_job_id"], namespace)
+
+        if wait and dispatched:
+            # one shared wait: all watches ride the same event stream subscription and wake the same condition
+            tail_ids = [registry.register(token, namespace, job, item["dispatched_job_id"], timeout) for item in dispatched]
+            shared = threading.Condition()
+            with ExitStack() as stack:
+                stack.enter_context(inflight_waits.labels("batch").track_inprogress())
+                watches = [stack.enter_context(job_watch(token, namespace, item["dispatched_job_id"], shared)) for item in dispatched]
+                wait_for_jobs(
+                    watches,
+                    lambda watch, fresh_since: list_job_allocations(token, namespace, watch.job_id, fresh_since)[0],
+                    job_finished,
+                    timeout,
+                    cancelled=lambda: registry.any_cancel_requested(tail_ids),
+                )
+            cancelled = registry.any_cancel_requested(tail_ids)
+
+            def settle(item, watch):
+                alloc = watch.latest_alloc()
+                item["state"] = job_state(alloc)
+                if job_finished(watch):
+                    result, code = finished_job_result(headers, namespace, alloc, item["nomad_ui_job_url"], log_bytes)
+                    item.update(result, status="failed" if code == 418 else "completed")
+                else:
+                    item["status"] = "cancelled" if cancelled else "timeout"
+                outcome = item["state"] if item["status"] in ("completed", "failed") else item["status"]
+                observe_job_lifecycle(job, namespace, None if item["duplicate"] else item["dispatched_at"], alloc, outcome)
+
+            with ThreadPoolExecutor(max_workers=min(max_parallel, len(dispatched)), thread_name_prefix="settle") as pool:
+                list(pool.map(traced(settle), dispatched, watches))
+            for tail_id, item in zip(tail_ids, dispatched):
+                registry.finish(tail_id, item["state"] if item["status"] in ("completed", "failed") else item["status"])
+
+        summary = {"total": len(items), "waited": wait}
+        for item in items:
+            item.pop("dispatched_at")
+            summary[item["status"]] = summary.get(item["status"], 0) + 1
+        summary["elapsed"] = round(time.time() - batch_start, 3)
+        summary["items"] = items
+        logger.info({k: v for k, v in summary.items() if k != "items"})
+        # 200 only when every item went through (and completed, when waiting)
+        ok = summary.get("completed" if wait else "dispatched", 0) == len(items)
+        return jsonify(summary), 200 if ok else 418
+
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except requests.exceptions.RequestException as e:
+        return jsonify({"error": f"Unexpected error: {e}"}), 500
 
-        result = {
-            "status": "completed",
-            "client_status": final_status,
-            "nomad_ui_job_url": nomad_ui_job_url,
-        }
-        if verbose:
-            result["meta"] = data["meta"]
-        return jsonify(result), 200
 
+@app.route("/api/<token>/<namespace>/status/<path:dispatched_id>", methods=["GET"])
+def dispatched_job_status(token, namespace, dispatched_id):
+    try:
+        headers = {"X-Nomad-Token": token}
+        known_state = request.args.get("state")  # last state the caller saw, returns as soon as it differs
+        try:
+            wait = min(parse_duration(request.args.get("wait")), STATUS_MAX_WAIT)
+            log_bytes = int_param("log_bytes", request.args.get("log_bytes"), LOG_TAIL_BYTES, 1, MAX_LOG_BYTES)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        nomad_ui_job_url = job_ui_url(dispatched_id, namespace)
+
+        def poll_allocations(fresh_since=None):
+            return list_job_allocations(token, namespace, dispatched_id, fresh_since)[0]
+
+        with job_watch(token, namespace, dispatched_id) as watch:
+            wait_for_job(watch, poll_allocations, lambda w: True, 0)
+            # no allocation yet: only worth waiting for when the job exists, a mistyped ID would stay "pending" forever
+            if (
+                watch.latest_alloc() is None
+                and not registry.knows_dispatch(dispatched_id)
+                and not job_exists(token, namespace, dispatched_id)
+            ):
+                return jsonify({"error": f"Dispatched job {dispatched_id} not found in namespace {namespace}"}), 404
+            known_state = known_state or job_state(watch.latest_alloc())
+            if wait > 0:
+                # a finished job never changes again, no point in holding the caller
+                with inflight_waits.labels("status").track_inprogress():
+                    wait_for_job(
+                        watch,
+                        poll_allocations,
+                        lambda w: job_state(w.latest_alloc()) != known_state
+                        or job_state(w.latest_alloc()).lower() not in ("pending", "running"),
+                        wait,
+                    )
+            alloc = watch.latest_alloc()
+
+        state = job_state(alloc)
+        if state.lower() not in ("pending", "running"):
+            result, code = finished_job_result(headers, namespace, alloc, nomad_ui_job_url, log_bytes)
+            result.update(state=state, dispatched_job_id=dispatched_id)
+            return jsonify(result), code
+
+        return (
+            jsonify(
+                {
+                    "status": state,
+                    "state": state,
+                    "changed": state != known_state,
+                    "dispatched_job_id": dispatched_id,
+                    "nomad_ui_job_url": nomad_ui_job_url,
+                }
+            ),
+            200,
+        )
+
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
     except requests.exceptions.ConnectionError as e:
         return jsonify({"error": f"Connection error: {e}"}), 503
     except requests.exceptions.Timeout as e:
         return jsonify({"error": f"Timeout error (TIMEOUT:{TIMEOUT}): {e}"}), 504
     except requests.exceptions.HTTPError as e:
-        return jsonify({"error": f"HTTP error: {e}"}), response.status_code
-    except requests.exceptions.TooManyRedirects as e:
-        return jsonify({"error": f"Too many redirects: {e}"}), 310
+        return jsonify({"error": f"HTTP error: {e}"}), e.response.status_code
     except requests.exceptions.RequestException as e:
         return jsonify({"error": f"Unexpected error: {e}"}), 500
 
@@ -351,19 +2870,65 @@ def dispatch_wait_and_tail(token, namespace, job):
 @app.route("/api/<token>/<namespace>/cancel/<job>", methods=["POST"])
 def cancel_job_stream(token, namespace, job):
     task_id = f"{token}:{namespace}:{job}"
-    if task_id in cancel_flags:
-        cancel_flags[task_id] = True
+    if registry.cancel(token, namespace, job):
         return jsonify({"status": "cancelled", "task_id": task_id}), 200
     return jsonify({"error": "No active task found"}), 404
 
 
+@app.route("/api/<token>/<namespace>/tails", methods=["GET"])
+def list_tails(token, namespace):
+    job = request.args.get("job")
+    return jsonify({"tails": registry.list(token, namespace, job)}), 200
+
+
+class UpstreamProbe(threading.Thread):
+    """Asks NOMAD_ADDR for its leader every HEALTH_PROBE_INTERVAL seconds, /health?deep=1 only reads the last result."""
+
+    def __init__(self, interval=HEALTH_PROBE_INTERVAL):
+        super().__init__(name="upstream-probe", daemon=True)
+        self.interval = interval
+        self.result = {"ok": None, "checked_at": None}
+
+    def probe(self):
+        started = time.time()
+        try:
+            resp = nomad.get(f"{NOMAD_ADDR}/v1/status/leader", op="health", priority=PRIORITY_BACKGROUND, probe=True)
+            resp.raise_for_status()
+            result = {"ok": True, "leader": resp.json()}
+        except Exception as e:
+            result = {"ok": False, "error": str(e)}
+        result.update(latency=round(time.time() - started, 3), checked_at=datetime.now(timezone.utc).isoformat(timespec="seconds"))
+        self.result = result
+
+    def run(self):
+        while True:
+            self.probe()
+            time.sleep(self.interval)
+
+
+upstream_probe = UpstreamProbe()
+if HEALTH_PROBE_INTERVAL > 0:
+    upstream_probe.start()
+
+
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "healthy"}), 200
+    if request.args.get("deep", "").lower() not in ("1", "true"):
+        return jsonify({"status": "healthy"}), 200
+    # never calls Nomad itself: breaker states plus the last background probe
+    breakers = {host: breaker.status() for host, breaker in list(nomad.scheduler.breakers.items())}
+    probe = upstream_probe.result
+    degraded = probe["ok"] is False or any(breaker["state"] == "open" for breaker in breakers.values())
+    result = {"status": "degraded" if degraded else "healthy", "upstream": {"probe": probe, "breakers": breakers}}
+    return jsonify(result), 503 if degraded else 200
 
 
 @app.route("/")
 def home():
+    return static_assets.serve("home")
+
+
+def render_home():
     return """
     <!DOCTYPE html>
     <html>
@@ -392,6 +2957,10 @@ def home():
 
 @app.route("/about")
 def about():
+    return static_assets.serve("about")
+
+
+def render_about():
     return """
     <!DOCTYPE html>
     <html>
@@ -437,20 +3006,30 @@ def about():
 
 @app.route("/favicon.ico")
 def serve_favicon():
-    cache_favicon()
-    if os.path.exists(FAVICON_PATH):
-        return send_file(FAVICON_PATH, mimetype="image/vnd.microsoft.icon")
-    return "", 404
+    # 404 until the background prefetch has it
+    return static_assets.serve("favicon")
 
 
 # Route to list all available endpoints
 @app.route("/routes")
 def list_routes():
-    example_values = {"token": "00000000-2000-0000-0000-000000000000", "namespace": "default", "job": "job42"}
+    return static_assets.serve("routes")
+
+
+def render_routes():
+    example_values = {
+        "token": "00000000-2000-0000-0000-000000000000",
+        "namespace": "default",
+        "job": "job42",
+        "dispatched_id": "job42/dispatch-1700000000-0a1b2c3d",
+    }
 
     descriptions = {
         "dispatch_wait_and_tail": "Dispatches a job and waits for its output stream.",
         "cancel_job_stream": "Cancels a running job stream.",
+        "dispatch_batch": "Dispatches a job once per meta set (repeated query values multiply, or POST a JSON list), optionally waits.",
+        "dispatched_job_status": "Status of a dispatched job, ?wait=60s&state=<last seen> long-polls until it changes.",
+        "list_tails": "Lists open and recently finished tails (optionally ?job=) across all workers.",
         "restart_allocations": "Restarts allocations for a given token and namespace.",
         "health": "Health check endpoint.",
         "home": "Home page.",
@@ -472,7 +3051,7 @@ def list_routes():
         # Build example URL accordingly
         try:
             if has_args:
-                example_url = url_for(endpoint, **example_values)
+                example_url = url_for(endpoint, **{k: v for k, v in example_values.items() if k in rule.arguments})
             else:
                 example_url = url_for(endpoint)
         except Exception:
@@ -483,6 +3062,24 @@ def list_routes():
     return "<br>".join(output)
 
 
+def build_static_assets():
+    # after every route is registered: the routes page is rendered from url_map
+    static_assets.put("home", render_home(), "text/html")
+    static_assets.put("about", render_about(), "text/html")
+    with app.test_request_context():
+        static_assets.put("routes", render_routes(), "text/html")
+
+
+build_static_assets()
+threading.Thread(target=prefetch_favicon, name="favicon", daemon=True).start()
+
+
 if __name__ == "__main__":
-    cache_favicon()
-    app.run(host="0.0.0.0", port=int(os.getenv("NOMAD_PORT_juggler", 5000)))
+    port = int(os.getenv("NOMAD_PORT_juggler", 5000))
+    if JUGGLER_SERVER == "gevent":
+        from gevent.pywsgi import WSGIServer
+
+        logger.info(f"Serving with gevent on port {port}")
+        WSGIServer(("0.0.0.0", port), app, log=None).serve_forever()
+    else:
+        app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,134 @@
+"""Unit tests for nomad-juggler, no Nomad needed.
+
+python -m unittest discover -s tests
+"""
+
+import importlib.util
+import os
+import threading
+import time
+import unittest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# nothing in the background: no health probe, no favicon prefetch
+os.environ.setdefault("HEALTH_PROBE_INTERVAL", "0")
+os.environ.setdefault("FAVICON_URL", "http://127.0.0.1:1/favicon.ico")
+
+spec = importlib.util.spec_from_file_location("nomad_juggler", os.path.join(APP_DIR, "nomad-juggler.py"))
+nj = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(nj)
+
+
+class JobWatchTest(unittest.TestCase):
+    def test_stale_poll_after_event_keeps_event(self):
+        watch = nj.JobWatch("batch/dispatch-1")
+        watch.update_alloc({"ID": "a1", "ClientStatus": "complete", "ModifyIndex": 10, "CreateTime": 1})
+        changed = watch.refresh([{"ID": "a1", "ClientStatus": "running", "ModifyIndex": 7, "CreateTime": 1}])
+        self.assertFalse(changed)
+        self.assertTrue(nj.job_finished(watch))
+
+    def test_newer_poll_replaces(self):
+        watch = nj.JobWatch("batch/dispatch-1")
+        watch.update_alloc({"ID": "a1", "ClientStatus": "running", "ModifyIndex": 7, "CreateTime": 1})
+        changed = watch.refresh([{"ID": "a1", "ClientStatus": "complete", "ModifyIndex": 10, "CreateTime": 1}])
+        self.assertTrue(changed)
+        self.assertTrue(nj.job_finished(watch))
+
+
+class IterRestartsTest(unittest.TestCase):
+    def test_empty_selection(self):
+        self.assertEqual(list(nj.iter_restarts([], lambda alloc: {"ok": True})), [])
+        self.assertEqual(list(nj.iter_restarts([], lambda alloc: {"ok": True}, batch_size=5)), [])
+
+    def test_restarts_every_alloc(self):
+        allocs = [{"ID": f"a{i}", "NodeID": f"n{i % 3}"} for i in range(7)]
+        results = list(nj.iter_restarts(allocs, lambda alloc: {"ok": True}, max_parallel=4, per_node_parallel=1, batch_size=3))
+        self.assertEqual(sorted(alloc["ID"] for alloc, _ in results), sorted(alloc["ID"] for alloc in allocs))
+
+
+class IntParamTest(unittest.TestCase):
+    def test_default_and_clamp(self):
+        self.assertEqual(nj.int_param("log_bytes", None, 10000, 1, 100000), 10000)
+        self.assertEqual(nj.int_param("log_bytes", "", 10000, 1, 100000), 10000)
+        self.assertEqual(nj.int_param("log_bytes", "0", 10000, 1, 100000), 1)
+        self.assertEqual(nj.int_param("log_bytes", "-5", 10000, 1, 100000), 1)
+        self.assertEqual(nj.int_param("log_bytes", "999999", 10000, 1, 100000), 100000)
+
+    def test_not_a_number(self):
+        with self.assertRaisesRegex(ValueError, "timeout"):
+            nj.int_param("timeout", "abc", 1200, 1, 86400)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_half_open_trial_released_when_the_call_never_went_out(self):
+        host = "http://127.0.0.1:1"
+        _, bucket, breaker = nj.nomad.scheduler.upstream(host + "/v1/status/leader")
+        breaker.state, breaker.opened_at = "open", time.time() - nj.BREAKER_OPEN_SECONDS - 1
+
+        def acquire(priority):
+            raise RuntimeError("bucket failed")
+
+        bucket.acquire = acquire
+        with self.assertRaises(RuntimeError):
+            nj.nomad.get(host + "/v1/status/leader")
+        self.assertFalse(breaker.trial)
+        self.assertEqual(breaker.state, "open")
+        # the next trial is let through again once the breaker was open long enough
+        breaker.opened_at = time.time() - nj.BREAKER_OPEN_SECONDS - 1
+        with self.assertRaises(RuntimeError):
+            nj.nomad.get(host + "/v1/status/leader")
+
+
+class AllocListCacheTest(unittest.TestCase):
+    def test_fresh_caller_skips_a_fetch_that_started_before_it_went_stale(self):
+        cache = nj.AllocListCache(ttl=2)
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(time.time())
+            if len(calls) == 1:
+                release.wait(5)
+                return [{"ID": "old"}], 1, 10
+            return [{"ID": "new"}], 2, 10
+
+        key = ("token", "default", "job", None)
+        slow = threading.Thread(target=cache.get, args=(key, fetch))
+        slow.start()
+        while not calls:
+            time.sleep(0.01)
+        stale_since = time.time()
+        allocations, index = cache.get(key, fetch, fresh_since=stale_since)
+        release.set()
+        slow.join()
+        self.assertEqual((allocations, index), ([{"ID": "new"}], 2))
+        self.assertEqual(len(calls), 2)
+
+    def test_fresh_caller_joins_a_fetch_that_started_after_it_went_stale(self):
+        cache = nj.AllocListCache(ttl=2)
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(time.time())
+            release.wait(5)
+            return [{"ID": "a"}], 1, 10
+
+        key = ("token", "default", "job", None)
+        stale_since = time.time() - 1
+        slow = threading.Thread(target=cache.get, args=(key, fetch))
+        slow.start()
+        while not calls:
+            time.sleep(0.01)
+        joined = threading.Thread(target=cache.get, args=(key, fetch), kwargs={"fresh_since": stale_since})
+        joined.start()
+        time.sleep(0.05)
+        release.set()
+        slow.join()
+        joined.join()
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()